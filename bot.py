@@ -10,41 +10,95 @@ License.
 
 import os
 import sys
+import time
 import traceback
-import re
-import logging
 
+from contextlib import contextmanager
 from datetime import datetime
 from discord import Game
 from discord.ext import commands
 from utils.db import migration_handler
 from utils.db import db
-
-
-def build_bot(prefix, config):
-
-    BOT = commands.Bot(command_prefix=prefix)
+from utils import dispatch, health, inline, metrics, outbox, profiler
+from utils import logs, reloader, throttle
+from utils.rolling import rng
+
+
+def build_bot(prefix, config, shard_ids=None, shard_count=None, cluster=0):
+    """
+    Builds the bot. A sharded bot is built when sharding is enabled in the
+    config or shards are passed in by the cluster launcher.
+
+    Parameters:
+        prefix: str
+        config: dict
+        shard_ids: [int, int..., int] or None
+        shard_count: int or None
+        cluster: int, the id of the cluster running the bot
+
+    Returns:
+        commands.Bot
+    """
+
+    started = time.perf_counter()
+    sharding = config.get('sharding', {})
+
+    if shard_ids is not None or sharding.get('enabled'):
+        BOT = commands.AutoShardedBot(
+            command_prefix=prefix, shard_ids=shard_ids,
+            shard_count=shard_count or sharding.get('shard_count'))
+    else:
+        BOT = commands.Bot(command_prefix=prefix)
+
+    BOT.started = started
+    BOT.cluster = cluster
+    BOT.started_up = False
+    BOT.served = False
     BOT.sr_rules = config['optional_rolling_rules']
+    BOT.persist_combat = config.get('persist_combat', False)
+    BOT.watch_reload = config.get('watch_reload', False)
+    BOT.metrics_config = config.get('metrics', {})
+    BOT.slow_callbacks = config.get('slow_callback_seconds')
+    BOT.watchdog_config = config.get('watchdog', {})
+
+    # A fixed seed makes every roll reproducible from its token. The cluster
+    # and a fresh boot nonce keep clusters and restarts on streams of their own
+    rng.seed(config.get('rng_seed'), cluster)
 
     # Database handler
     BOT.db_handler = db.DBHandler()
 
-    # Configure the bot to log error messages properly
-    BOT.logger = logging.getLogger()
-    if not BOT.logger.handlers:
-        logging.basicConfig(format='%(asctime)s %(message)s',
-                            datefmt='%Y-%m-%d %H:%M:%S')
-        stream_handler = logging.StreamHandler(sys.stdout)
-        BOT.logger.addHandler(stream_handler)
+    # Counts what on_message does with the messages it sees
+    BOT.dispatch_stats = dispatch.DispatchStats()
+
+    # Token buckets limiting how fast commands may be sent
+    BOT.throttle = throttle.from_config(config)
+
+    # Replies are queued and sent per channel by the outbox
+    BOT.outbox = outbox.Outbox()
+
+    # Command and stage latencies
+    BOT.metrics = metrics.METRICS
+    BOT.after_invoke(metrics.finish_command)
+
+    @BOT.before_invoke
+    async def before_invoke(ctx):
+        profiler.tag_task(ctx)
+        await metrics.start_command(ctx)
+
+    # Log through a queue, so writing logs never blocks the event loop
+    BOT.logger = logs.setup(config.get('logging', {}))
 
     BOT.logger.info("Logging initialized.")
+    BOT.logger.info("Configuring the bot took "
+                    f"{(time.perf_counter() - started) * 1000:.1f}ms")
 
     @BOT.event
     async def on_member_join(member):
         # Setup user information here.
         pass
 
-    async def update_db():
+    def update_db():
         """
         Updates the database with the migration handler.
 
@@ -71,25 +125,63 @@ def build_bot(prefix, config):
         else:
             BOT.logger.info("No database updates available")
 
+    def startup():
+        """
+        Gets the bot ready to serve commands before it connects. Runs once
+        per bot, however often the gateway reconnects afterwards.
+        """
+
+        if BOT.started_up:
+            return
+
+        with timed(BOT.logger, "Database migrations"):
+            update_db()
+
+        with timed(BOT.logger, "Loading cogs"):
+            load_cogs()
+
+        # Reload cogs as their files change
+        if BOT.watch_reload:
+            BOT.watcher = BOT.loop.create_task(reloader.watch(BOT))
+
+        # Measure how far behind the event loop falls
+        BOT.watchdog = health.Watchdog(
+            BOT, BOT.watchdog_config.get('interval', health.INTERVAL),
+            BOT.watchdog_config.get('threshold', health.THRESHOLD))
+        BOT.watchdog.start(BOT.loop)
+
+        # Log callbacks holding up the event loop
+        if BOT.slow_callbacks:
+            profiler.report_slow_callbacks(BOT.loop, BOT.slow_callbacks)
+
+        # Export metrics on localhost or to a file
+        port = BOT.metrics_config.get('port')
+        path = BOT.metrics_config.get('file')
+        if port or path:
+            BOT.metrics_exporter = BOT.loop.create_task(metrics.serve(
+                BOT, port, path,
+                BOT.metrics_config.get('interval', metrics.EXPORT_INTERVAL)))
+
+        BOT.started_up = True
+        BOT.logger.warning("Startup complete after "
+                           f"{time.perf_counter() - BOT.started:.2f}s.")
+
+    BOT.startup = startup
+
     @BOT.event
     async def on_ready():
         """
-        Post setup hook.
-        Initializes any necessary variables and sets the played game to
-        a message on how to get help.
+        Sets the played game to a message on how to get help. This runs again
+        every time the gateway reconnects, so the bot is set up beforehand by
+        startup instead.
         """
 
-        await update_db()
-
         # Uptime statistic
-        BOT.boot_time = datetime.now()
-
-        # Load all cogs
-        BOT.logger.info("Startup complete, loading cogs.")
-        await load_cogs()
-        BOT.logger.info("Cog loading complete.")
-        BOT.logger.info("Connected to server and awaiting commands.")
-        BOT.logger.warn("Bot is ready to receive commands.")
+        if not hasattr(BOT, 'boot_time'):
+            BOT.boot_time = datetime.now()
+            BOT.logger.warning("Connected and ready "
+                               f"{time.perf_counter() - BOT.started:.2f}s "
+                               "after startup began.")
 
         # Set help message
         help_message = Game(name=f"message '{prefix}help' for help")
@@ -104,31 +196,51 @@ def build_bot(prefix, config):
         see if users are active on the guild.
         """
 
-        if message.author.bot:
+        content = message.content
+        stats = BOT.dispatch_stats
+        stats.seen += 1
+
+        if not dispatch.is_candidate(content, prefix):
+            stats.rejected += 1
             return
 
-        if message.content.startswith(f"{BOT.command_prefix*2}"):
+        if message.author.bot or content.startswith(prefix * 2):
+            stats.rejected += 1
             return
 
-        if message.content.startswith(prefix):
-            await BOT.process_commands(message)
-            command = message.content.split()
-            command = command[0].replace(BOT.command_prefix, "")
+        if content.startswith(prefix):
+            stats.dispatched += 1
+            await process_commands(message)
+
+        if dispatch.INLINE_MARKER not in content:
+            return
 
-        commands = re.findall("{%(.*?)%}", message.content)
+        commands = inline.find_inline(content)
         if commands:
-            for command in commands:
-                command = command.strip()
-                if not command.startswith(BOT.command_prefix):
-                    command = BOT.command_prefix + command
-                message.content = command
-                await BOT.process_commands(message)
+            stats.inline += 1
+            await inline.run_inline(BOT, message, commands)
+
+    async def process_commands(message):
+        """
+        Does what Bot.process_commands does, with the command throttled
+        before it is invoked.
+        """
+
+        ctx = await BOT.get_context(message, cls=outbox.QueuedContext)
+        if await throttle.admit(BOT, ctx):
+            await BOT.invoke(ctx)
+
+        if not BOT.served and ctx.command is not None:
+            BOT.served = True
+            BOT.logger.warning("First command served "
+                               f"{time.perf_counter() - BOT.started:.2f}s "
+                               "after startup began.")
 
     @BOT.event
     async def on_command_error(ctx, error):
         await ctx.send(error)
 
-    async def load_cogs(unload_first=False):
+    def load_cogs():
         """
         Handles loading all cogs in for the bot.
         """
@@ -140,16 +252,15 @@ def build_bot(prefix, config):
 
         for extension in cogs:
             try:
-                BOT.logger.debug(f"Loading {extension}...")
-                BOT.load_extension(f"cogs.{extension}")
-                BOT.logger.debug(f"Loaded {extension}")
+                with timed(BOT.logger, f"Loading {extension}"):
+                    BOT.load_extension(f"cogs.{extension}")
 
             except AttributeError:
-                BOT.logger.critical(f"Cog {extension} is malformed.",
+                BOT.logger.critical(f"Cog {extension} is malformed. "
                                     "Do you have a setup function?")
 
             except ModuleNotFoundError:
-                BOT.logger.warn(f"Could not find {extension}.",
+                BOT.logger.warn(f"Could not find {extension}. "
                                 "Please make sure it exists.")
 
             except OSError as lib_error:
@@ -170,6 +281,20 @@ def build_bot(prefix, config):
     return BOT
 
 
+@contextmanager
+def timed(logger, phase):
+    """
+    Logs how long a phase of startup took.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"{phase} took {elapsed:.1f}ms")
+
+
 if __name__ == "__main__":
     print("The bot must be ran with 'python main.py'")
     sys.exit()
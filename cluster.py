@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+import aiohttp
+import discord
+
+from utils.db import migration_handler
+
+
+"""
+Runs the bot as a cluster of processes, each owning a range of shards.
+
+The supervisor works out how many shards to run, migrates the database once,
+then starts one worker process per cluster and watches them. A worker that
+exits, whether it crashed or was restarted with ?restart, is started again
+after a short delay. Workers that keep dying are started again more slowly.
+Once the "poweroff" file exists every worker is stopped and the supervisor
+exits.
+
+The workers share the SQLite database. Each connection waits on a locked
+database instead of failing straight away, so writes from different workers
+take turns.
+
+Setting "api_base" in the config points both the supervisor and the workers
+at another Discord API, such as a fake gateway running locally.
+"""
+
+
+# Seconds a worker waits before it is started again, doubled each time it
+# dies quickly, up to the maximum
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+
+# A worker running at least this long is considered healthy again
+HEALTHY_AFTER = 60
+
+# How often the supervisor checks on the workers, in seconds
+POLL_INTERVAL = 1
+
+
+def use_api_base(config):
+    """
+    Points discord.py at the API base set in the config, if any.
+    """
+
+    if config.get("api_base"):
+        discord.http.Route.BASE = config["api_base"].rstrip("/")
+
+
+async def recommended_shards(token):
+    """
+    Asks Discord how many shards the bot should run.
+
+    Parameters:
+        token: str
+
+    Returns:
+        int
+    """
+
+    url = f"{discord.http.Route.BASE}/gateway/bot"
+    headers = {"Authorization": f"Bot {token}"}
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            data = await response.json()
+
+    return data["shards"]
+
+
+def shard_ranges(shard_count, clusters):
+    """
+    Splits the shards into a contiguous range for each cluster.
+
+    Parameters:
+        shard_count: int
+        clusters: int
+
+    Returns:
+        [[int, int..., int], ...]
+    """
+
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+
+    ranges = []
+    start = 0
+    for cluster in range(clusters):
+        end = start + size + (1 if cluster < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
+
+
+def worker(cluster, shard_ids, shard_count, prefix, config, token):
+    """
+    Runs a single cluster. This is the entry point of every worker process.
+    """
+
+    import bot
+
+    use_api_base(config)
+
+    logging.getLogger().info(f"Cluster {cluster} starting with shards "
+                             f"{shard_ids[0]}-{shard_ids[-1]} of "
+                             f"{shard_count}")
+
+    BOT = bot.build_bot(prefix, config, shard_ids=shard_ids,
+                        shard_count=shard_count, cluster=cluster)
+    BOT.startup()
+    BOT.run(token)
+    BOT.db_handler.close()
+
+
+class Worker():
+    """
+    A worker process and what the supervisor knows about it.
+    """
+
+    def __init__(self, cluster, shard_ids):
+        self.cluster = cluster
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started = 0
+        self.delay = RESTART_DELAY
+        self.restart_at = 0
+
+
+def supervise(prefix, config, token):
+    """
+    Runs the cluster until the bot is powered off.
+
+    Parameters:
+        prefix: str
+        config: dict
+        token: str
+    """
+
+    logger = logging.getLogger()
+    sharding = config.get("sharding", {})
+
+    use_api_base(config)
+
+    shard_count = sharding.get("shard_count")
+    if not shard_count:
+        shard_count = asyncio.run(recommended_shards(token))
+
+    # Migrating here keeps the workers from racing each other to do it
+    migration_handler.DBMigrationHandler().migrate_all()
+
+    context = multiprocessing.get_context("spawn")
+    workers = [Worker(cluster, shard_ids) for cluster, shard_ids
+               in enumerate(shard_ranges(shard_count,
+                                         sharding.get("clusters", 1)))]
+
+    logger.warning(f"Starting {len(workers)} clusters for {shard_count} "
+                   "shards")
+
+    try:
+        while not os.path.exists("poweroff"):
+            now = time.monotonic()
+
+            for worker_state in workers:
+                process = worker_state.process
+                if process is not None and process.is_alive():
+                    continue
+
+                if process is not None:
+                    process.join()
+                    logger.warning(f"Cluster {worker_state.cluster} exited "
+                                   f"with code {process.exitcode}")
+
+                    if now - worker_state.started < HEALTHY_AFTER:
+                        worker_state.delay = min(worker_state.delay * 2,
+                                                 MAX_RESTART_DELAY)
+                    else:
+                        worker_state.delay = RESTART_DELAY
+
+                    worker_state.process = None
+                    worker_state.restart_at = now + worker_state.delay
+
+                if now < worker_state.restart_at:
+                    continue
+
+                worker_state.process = context.Process(
+                    target=worker,
+                    args=(worker_state.cluster, worker_state.shard_ids,
+                          shard_count, prefix, config, token),
+                    name=f"cluster-{worker_state.cluster}")
+                worker_state.process.start()
+                worker_state.started = now
+
+            time.sleep(POLL_INTERVAL)
+    finally:
+        logger.warning("Stopping all clusters")
+        for worker_state in workers:
+            if worker_state.process is not None:
+                worker_state.process.terminate()
+        for worker_state in workers:
+            if worker_state.process is not None:
+                worker_state.process.join()
@@ -7,8 +7,12 @@ Please see the license for any restrictions or rights granted to you by the
 License.
 """
 
+import io
+
+from discord import File
 from discord.ext import commands
 from discord.client import Client
+from utils import health, metrics, profiler, reloader
 
 
 class Admin(commands.Cog):
@@ -39,6 +43,131 @@ class Admin(commands.Cog):
         self.bot.logger.warn("Bot is restarting")
         await Client.close(self.bot)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def reload(self, ctx, cog):
+        """
+        Reloads a cog and the utils modules it uses without restarting.
+        """
+
+        try:
+            elapsed, modules, others = await reloader.reload(self.bot, cog)
+        except Exception as error:
+            return await ctx.send(f"Reloading {cog} failed: "
+                                  f"{type(error).__name__}: {error}")
+
+        also = f" along with {', '.join(others)}" if others else ""
+        await ctx.send(f"Reloaded {cog} and {len(modules)} utils modules"
+                       f"{also} in {elapsed * 1000:.0f}ms.")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """
+        Shows how long commands and their stages have been taking.
+        """
+
+        lines = ["Command            Count    p50    p90    p99    max"]
+        for name, histogram in sorted(metrics.METRICS.commands.items()):
+            lines.append(stats_line(name, histogram))
+
+        lines.append("")
+        lines.append("Stage              Count    p50    p90    p99    max")
+        for (name, stage), histogram in sorted(metrics.METRICS.stages.items()):
+            lines.append(stats_line(f"{name or '-'}/{stage}", histogram))
+
+        errors = {label: value for (counter, label), value
+                  in metrics.METRICS.counters.items() if counter == "errors"}
+        if errors:
+            lines.append("")
+            lines.append("Errors: " + ", ".join(
+                f"{name} {count}" for name, count in sorted(errors.items())))
+
+        stats = self.bot.dispatch_stats.as_dict()
+        lines.append("")
+        lines.append("Messages: " + ", ".join(
+            f"{outcome} {count}" for outcome, count in stats.items()))
+
+        message = "\n".join(lines)
+        if len(message) > 1900:
+            message = message[:1900] + "\n…"
+
+        await ctx.send(f"```\n{message}\n```")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def health(self, ctx):
+        """
+        Shows uptime, gateway latency, event loop lag and what is running.
+        """
+
+        await ctx.send(await health.format_health(self.bot))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: float = 10):
+        """
+        Profiles the event loop for a while and sends the report.
+        """
+
+        seconds = min(max(seconds, 0), profiler.MAX_SECONDS)
+        await ctx.send(f"Profiling for {seconds:g} seconds.")
+
+        try:
+            report = await profiler.profile(seconds)
+        except profiler.ProfilerBusyError:
+            return await ctx.send("A profile is already running.")
+
+        report = File(io.BytesIO(report.encode()), filename="profile.txt")
+        await ctx.send(file=report)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def dispatchstats(self, ctx):
+        """
+        Shows how many messages were rejected by the on_message filter.
+        """
+
+        stats = self.bot.dispatch_stats
+        seen = stats.seen or 1
+
+        await ctx.send(f"Seen: {stats.seen}\n"
+                       f"Rejected: {stats.rejected} "
+                       f"({stats.rejected / seen:.1%})\n"
+                       f"Dispatched: {stats.dispatched}\n"
+                       f"Inline: {stats.inline}\n"
+                       f"Throttled: {stats.throttled}\n"
+                       f"Buckets: {len(self.bot.throttle)}")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def outbox(self, ctx):
+        """
+        Shows how backed up the outgoing message queues are.
+        """
+
+        outbox = self.bot.outbox
+        queued, deepest = outbox.depth()
+
+        await ctx.send(f"Queued: {queued} in {len(outbox.queues)} channels "
+                       f"(deepest {deepest})\n"
+                       f"Sent: {outbox.sent} ({outbox.merged} merged)\n"
+                       f"Latency p50: {outbox.latency(50) * 1000:.0f}ms, "
+                       f"p99: {outbox.latency(99) * 1000:.0f}ms")
+
+
+def stats_line(name, histogram):
+    """
+    Formats a histogram as one row of the ?stats table, in milliseconds.
+    """
+
+    times = [histogram.percentile(percentile) * 1000
+             for percentile in (50, 90, 99)]
+    times.append(histogram.max / 1000)
+
+    return f"{name[:18]:<18} {histogram.count:>6} " + \
+        " ".join(f"{value:>6.1f}" for value in times)
+
 
 def setup(bot):
     bot.add_cog(Admin(bot))
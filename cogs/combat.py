@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from discord.ext import commands
+from utils import metrics
+from utils.embeds import build_embed
+from utils.rolling.initiative import CombatantNotFoundError
+from utils.rolling.initiative import InvalidInitiativeError
+from utils.rolling.initiative import InitiativeTracker
+
+
+class Combat(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.db_handler = self.bot.db_handler.combat
+        self.persist = self.bot.persist_combat
+
+        # Trackers are kept on the bot so a combat survives reloading the cog
+        if not hasattr(self.bot, "combat_trackers"):
+            self.bot.combat_trackers = {}
+        self.trackers = self.bot.combat_trackers
+
+    async def get_tracker(self, ctx, create=False):
+        """
+        Gets the initiative tracker for the channel, loading it from the
+        database if combats are persisted.
+        """
+
+        channel = ctx.channel.id
+
+        if channel not in self.trackers and self.persist:
+            state = await self.db_handler.get_combat(channel)
+            if state:
+                self.trackers[channel] = InitiativeTracker.from_dict(state)
+
+        if channel not in self.trackers and create:
+            self.trackers[channel] = InitiativeTracker()
+
+        return self.trackers.get(channel)
+
+    async def save(self, ctx, tracker):
+        if self.persist:
+            await self.db_handler.save_combat(ctx.channel.id,
+                                              tracker.to_dict())
+
+    async def send_order(self, ctx, tracker, title="Initiative"):
+        message = tracker.format_order()
+        embed = await build_embed(ctx, title, message,
+                                  footer="SR3e Initiative")
+        return await ctx.send(embed=embed)
+
+    @commands.group(invoke_without_command=True)
+    async def combat(self, ctx):
+        """
+        Tracks initiative for a combat in this channel. Shows the current
+        initiative order.
+        """
+
+        tracker = await self.get_tracker(ctx)
+        if not tracker:
+            return await ctx.send("There is no combat in this channel.")
+
+        return await self.send_order(ctx, tracker)
+
+    @combat.command()
+    async def join(self, ctx, dice: int, modifier: int = 0, *, name=None):
+        """
+        Joins the combat, rolling initiative dice and adding the modifier.
+        A name can be given to add an NPC.
+        """
+
+        tracker = await self.get_tracker(ctx, create=True)
+        name = name or ctx.author.display_name
+
+        try:
+            with metrics.timer("dice"):
+                combatant = tracker.join(name, dice, modifier)
+        except InvalidInitiativeError:
+            return await ctx.send("Initiative dice can't be negative.")
+
+        await self.save(ctx, tracker)
+
+        return await ctx.send(f"{name} joined the combat with an initiative "
+                              f"of {tracker.score(combatant)}.")
+
+    @combat.command(name="next")
+    async def advance(self, ctx):
+        """
+        Moves to the next action, starting new initiative passes and combat
+        turns as needed.
+        """
+
+        tracker = await self.get_tracker(ctx)
+        if not tracker:
+            return await ctx.send("There is no combat in this channel.")
+
+        # A new combat turn rolls initiative for everybody
+        with metrics.timer("dice"):
+            combatant = tracker.advance()
+        await self.save(ctx, tracker)
+
+        if not combatant:
+            return await ctx.send("Nobody is in this combat.")
+
+        title = f"{combatant.name} acts on {tracker.score(combatant)}"
+        return await self.send_order(ctx, tracker, title)
+
+    @combat.command()
+    async def delay(self, ctx, amount: int, *, name=None):
+        """
+        Delays an action by lowering the initiative score.
+        """
+
+        tracker = await self.get_tracker(ctx)
+        if not tracker:
+            return await ctx.send("There is no combat in this channel.")
+
+        name = name or ctx.author.display_name
+
+        try:
+            tracker.delay(name, amount)
+        except CombatantNotFoundError:
+            return await ctx.send(f"{name} is not in this combat.")
+        except InvalidInitiativeError:
+            return await ctx.send("A delay can't be negative.")
+
+        await self.save(ctx, tracker)
+        return await self.send_order(ctx, tracker)
+
+    @combat.command()
+    async def leave(self, ctx, *, name=None):
+        """
+        Leaves the combat.
+        """
+
+        tracker = await self.get_tracker(ctx)
+        if not tracker:
+            return await ctx.send("There is no combat in this channel.")
+
+        name = name or ctx.author.display_name
+
+        try:
+            tracker.leave(name)
+        except CombatantNotFoundError:
+            return await ctx.send(f"{name} is not in this combat.")
+
+        await self.save(ctx, tracker)
+        return await ctx.send(f"{name} left the combat.")
+
+    @combat.command()
+    async def end(self, ctx):
+        """
+        Ends the combat in this channel.
+        """
+
+        self.trackers.pop(ctx.channel.id, None)
+        if self.persist:
+            await self.db_handler.delete_combat(ctx.channel.id)
+
+        return await ctx.send("The combat has ended.")
+
+
+def setup(bot):
+    bot.add_cog(Combat(bot))
@@ -7,8 +7,11 @@ Please see the license for any restrictions or rights granted to you by the
 License.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from discord.ext import commands
-from utils.rolling import sr3e
+from utils import metrics
+from utils.rolling import expressions, odds, rng, simulation, sr3e
+from utils.rolling.parsers import InvalidArgumentsError, SR3_SIM_PARSER
 from utils.embeds import build_embed
 
 
@@ -16,34 +19,113 @@ class Rolling(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db_handler = self.bot.db_handler.rolling
+        self.executor = None
+
+    def cog_unload(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
 
     @commands.command(aliases=['r'])
     async def roll(self, ctx, *args):
         """
         Rolls dice. If no version is specified, this will default to SR3
         rolling rules.
-        """
 
-        roll = sr3e.Roll(*args)
-        print(roll.roll_type)
+        Dice expressions such as 12d6!>=5 + 3, (4+2)d6 kh3 or 2x(8d6>=4)
+        can be rolled as well.
+        """
 
-        if roll.roll_type == "help":
-            await roll.format_help()
-        if roll.roll_type == "initiative":
-            await roll.initaitive_roll()
-        if roll.roll_type == "open":
-            await roll.open_test()
-            print(roll.rolls)
-        elif roll.roll_type == "general":
-            await roll.roll()
-            userid = ctx.author.id
-            await self.db_handler.save_roll(userid, roll.rolls, roll.threshold)
+        if expressions.looks_like_expression(args):
+            expression, note = expressions.split_note(args)
+            return await self.roll_expression(ctx, expression, note)
+
+        try:
+            with metrics.timer("parse"):
+                roll = sr3e.Roll(*args)
+        except sr3e.RollTooLargeError as error:
+            return await ctx.send(str(error))
+        self.bot.logger.debug("Rolling a %s roll of %s dice", roll.roll_type,
+                              roll.dice)
+
+        with metrics.timer("dice"):
+            if roll.roll_type == "help":
+                await roll.format_help()
+            elif roll.roll_type == "initiative":
+                await roll.initiative_roll()
+            elif roll.roll_type == "open":
+                await roll.open_test()
+            elif roll.roll_type == "general":
+                await roll.roll()
+            elif roll.roll_type == "batch":
+                await roll.batch_roll()
+
+        # Only the last test of a batch is kept for rerolling, so a batch
+        # costs a single save.
+        if roll.roll_type in ("general", "batch"):
+            await self.db_handler.save_roll(ctx.author.id, roll.rolls,
+                                            roll.threshold)
 
         embed = await build_embed(ctx, roll.title, roll.message,
                                   footer=roll.footer)
 
         await ctx.send(embed=embed)
 
+    async def roll_expression(self, ctx, expression, note=None):
+        """
+        Rolls a dice expression and sends the result, titled with the note
+        if there is one.
+        """
+
+        try:
+            with metrics.timer("parse"):
+                plan = expressions.compile_expression(expression)
+            with metrics.timer("dice"):
+                results = plan.evaluate()
+        except expressions.ExpressionError as error:
+            return await ctx.send(str(error))
+
+        message = await expressions.format_results(plan, results)
+        embed = await build_embed(ctx, note or None, message,
+                                  footer="Dice Expression")
+        return await ctx.send(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def replay(self, ctx, token, *args):
+        """
+        Replays a roll exactly from the token in its footer.
+
+        Usage: replay <token> <roll arguments>
+        """
+
+        try:
+            stream = rng.from_token(token)
+        except rng.InvalidTokenError:
+            return await ctx.send(f"{token} is not a valid replay token.")
+
+        try:
+            with metrics.timer("parse"):
+                roll = sr3e.Roll(*args, stream=stream)
+        except sr3e.RollTooLargeError as error:
+            return await ctx.send(str(error))
+
+        if roll.roll_type == "help":
+            return await ctx.send("Only rolls can be replayed.")
+
+        with metrics.timer("dice"):
+            if roll.roll_type == "initiative":
+                await roll.initiative_roll()
+            elif roll.roll_type == "open":
+                await roll.open_test()
+            elif roll.roll_type == "general":
+                await roll.roll()
+            elif roll.roll_type == "batch":
+                await roll.batch_roll()
+
+        embed = await build_embed(ctx, "Replay", roll.message,
+                                  footer=roll.footer)
+        return await ctx.send(embed=embed)
+
     @commands.command(aliases=['rr'])
     async def reroll(self, ctx):
         """
@@ -55,19 +137,72 @@ class Rolling(commands.Cog):
         if not rolls:
             return await ctx.send("You have not yet made a roll.")
 
-        rolls = rolls.strip("[]").split(", ")
-        rolls = [int(roll) for roll in rolls]
-        dice = len([roll for roll in rolls if roll < threshold])
-        to_save = [roll for roll in rolls if roll >= threshold]
+        dice, to_save = rolls.split(threshold)
 
         roll = sr3e.Roll(str(dice), str(threshold))
-        await roll.reroll(to_save)
+        with metrics.timer("dice"):
+            await roll.reroll(to_save)
 
         await self.db_handler.save_roll(userid, roll.rolls, threshold)
         embed = await build_embed(ctx, roll.title, roll.message,
                                   footer=roll.footer)
         return await ctx.send(embed=embed)
 
+    @commands.command()
+    async def odds(self, ctx, dice: int, threshold: int = 4):
+        """
+        Shows the exact odds of a test without rolling it.
+        """
+
+        if dice < 0:
+            return await ctx.send("The dice pool cannot be negative.")
+
+        try:
+            glitches = self.bot.sr_rules.get("non-critical_glitch", False)
+            message = await odds.format_odds(dice, threshold, glitches)
+        except odds.OddsTooLargeError:
+            return await ctx.send(f"Odds can only be shown for up to "
+                                  f"{odds.MAX_DICE} dice.")
+
+        embed = await build_embed(ctx, "Odds", message, footer="SR3e Odds")
+        return await ctx.send(embed=embed)
+
+    @commands.command()
+    async def sim(self, ctx, *args):
+        """
+        Simulates many rolls of a test and reports how they turned out.
+
+        Usage: sim <dice> [threshold] [-n trials]
+        """
+
+        try:
+            parsed = SR3_SIM_PARSER.parse_args(args)
+        except InvalidArgumentsError:
+            return await ctx.send("Usage: sim <dice> [threshold] [-n trials]")
+
+        if parsed.dice < 0 or parsed.trials < 1:
+            return await ctx.send("Both the dice and the trials must be "
+                                  "positive.")
+
+        if not self.executor:
+            self.executor = ProcessPoolExecutor()
+
+        try:
+            result = await simulation.simulate(self.executor, parsed.dice,
+                                               parsed.threshold,
+                                               parsed.trials)
+        except simulation.SimulationTooLargeError:
+            return await ctx.send(f"That simulation is too large. Try fewer "
+                                  f"trials, or at most {odds.MAX_DICE} "
+                                  f"dice.")
+
+        message = await simulation.format_simulation(parsed.dice,
+                                                     parsed.threshold,
+                                                     parsed.trials, result)
+        embed = await build_embed(ctx, "Simulation", message,
+                                  footer="SR3e Simulation")
+        return await ctx.send(embed=embed)
+
 
 def setup(bot):
     bot.add_cog(Rolling(bot))
@@ -8,6 +8,7 @@ License.
 """
 
 import bot
+import cluster
 import importlib
 import json
 import os
@@ -49,19 +50,39 @@ def first_time_setup(SECRETS):
     return token
 
 
-CONFIG = load_config()
-SECRETS = load_secrets()
-TOKEN = SECRETS["token"]
+def main():
+    """
+    Runs the bot until it is powered off, either in this process or as a
+    cluster of worker processes.
+    """
+
+    config = load_config()
+    secrets = load_secrets()
+    token = secrets["token"]
+
+    if token == "BOT_TOKEN_HERE":
+        token = first_time_setup(secrets)
+
+    if config.get("sharding", {}).get("clusters", 1) > 1:
+        # Each cluster is a process of its own, restarted by the supervisor
+        cluster.supervise("?", config, token)
+    else:
+        cluster.use_api_base(config)
+
+        while not os.path.exists("poweroff"):
+            print("Bot is starting up...")
+            BOT = bot.build_bot("?", config)
+            BOT.startup()
+            BOT.run(token)
+            BOT.db_handler.close()
+            importlib.reload(bot)
 
-if TOKEN == "BOT_TOKEN_HERE":
-    TOKEN = first_time_setup(SECRETS)
+    # Remove the file "poweroff" so it'll turn on next time
+    os.remove("poweroff")
+    sys.exit()
 
-while not os.path.exists("poweroff"):
-    print("Bot is starting up...")
-    BOT = bot.build_bot("?", CONFIG)
-    BOT.run(TOKEN)
-    importlib.reload(bot)
 
-# Remove the file "poweroff" so it'll turn on next time
-os.remove("poweroff")
-sys.exit()
+# Cluster workers are spawned processes importing this module again, and must
+# not start a launcher of their own
+if __name__ == "__main__":
+    main()
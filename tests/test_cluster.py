@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from aiohttp import web
+
+
+"""
+Runs main.py in cluster mode against a fake Discord gateway served locally,
+and checks every cluster connects with its own shard and powers off cleanly.
+"""
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHARDS = 2
+CLUSTERS = 2
+
+# Seconds to wait on the clusters to connect, and to stop
+TIMEOUT = 60
+
+USER = {"id": "1", "username": "srbot", "discriminator": "0001",
+        "avatar": None, "bot": True}
+
+
+def json_response(data):
+    # discord.py only decodes a body typed exactly application/json, without
+    # the charset aiohttp adds to json_response
+    return web.Response(body=json.dumps(data).encode(),
+                        headers={"Content-Type": "application/json"})
+
+
+class FakeGateway():
+    """
+    Just enough of the Discord API and gateway for a bot to log in, connect
+    its shards and become ready.
+    """
+
+    def __init__(self):
+        self.identified = []
+        self.port = None
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.started.wait(TIMEOUT)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(TIMEOUT)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+
+        app = web.Application()
+        app.router.add_get("/users/@me", self.user)
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_get("/gateway/bot", self.gateway)
+        app.router.add_get("/ws", self.websocket)
+
+        runner = web.AppRunner(app)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(runner.cleanup())
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def user(self, request):
+        return json_response(USER)
+
+    async def gateway(self, request):
+        return json_response({
+            "url": f"ws://127.0.0.1:{self.port}/ws",
+            "shards": SHARDS,
+            "session_start_limit": {"total": 1000, "remaining": 1000,
+                                    "reset_after": 0},
+        })
+
+    async def websocket(self, request):
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        await socket.send_json({"op": 10, "d": {"heartbeat_interval": 45000}})
+
+        async for message in socket:
+            payload = json.loads(message.data)
+
+            if payload["op"] == 1:
+                await socket.send_json({"op": 11})
+            elif payload["op"] == 2:
+                shard = payload["d"].get("shard")
+                self.identified.append(tuple(shard))
+                await socket.send_json({
+                    "op": 0, "s": 1, "t": "READY",
+                    "d": {"v": 6, "user": USER, "guilds": [],
+                          "session_id": f"session-{shard[0]}",
+                          "shard": shard, "private_channels": [],
+                          "relationships": []},
+                })
+
+        return socket
+
+
+class TestCluster(unittest.TestCase):
+    def setUp(self):
+        self.gateway = FakeGateway()
+        self.gateway.start()
+
+        # The bot runs in a directory of its own, with the database, config
+        # and poweroff file kept there
+        self.directory = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(ROOT, "cogs"),
+                        os.path.join(self.directory, "cogs"),
+                        ignore=shutil.ignore_patterns("__pycache__"))
+
+        with open(os.path.join(ROOT, "config", "config.json")) as config:
+            config = json.load(config)
+        config["api_base"] = self.gateway.base
+        config["sharding"] = {"enabled": True, "shard_count": None,
+                              "clusters": CLUSTERS}
+
+        os.mkdir(os.path.join(self.directory, "config"))
+        with open(os.path.join(self.directory, "config",
+                               "config.json"), "w") as config_file:
+            json.dump(config, config_file)
+
+        os.mkdir(os.path.join(self.directory, "secrets"))
+        with open(os.path.join(self.directory, "secrets",
+                               "secrets.json"), "w") as secrets:
+            json.dump({"token": "fake-token"}, secrets)
+
+    def tearDown(self):
+        self.gateway.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_clusters_connect_and_power_off(self):
+        output_path = os.path.join(self.directory, "output.txt")
+        with open(output_path, "w") as output:
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "main.py")],
+                cwd=self.directory, stdout=output, stderr=subprocess.STDOUT)
+
+            try:
+                deadline = time.monotonic() + TIMEOUT
+                while (len(self.gateway.identified) < SHARDS
+                       and time.monotonic() < deadline
+                       and process.poll() is None):
+                    time.sleep(0.1)
+
+                identified = sorted(self.gateway.identified)
+
+                open(os.path.join(self.directory, "poweroff"), "w").close()
+                process.wait(TIMEOUT)
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+        with open(output_path) as output:
+            output = output.read()
+
+        self.assertEqual(identified, [(shard, SHARDS)
+                                      for shard in range(SHARDS)], output)
+        self.assertEqual(output.count("Starting 2 clusters for 2 shards"), 1,
+                         output)
+        self.assertNotIn("bootstrapping", output)
+        self.assertEqual(process.returncode, 0, output)
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     "poweroff")))
+
+
+if __name__ == "__main__":
+    unittest.main()
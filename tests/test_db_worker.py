@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from utils.db.worker import DBWorker
+
+
+"""
+The database worker has to keep the event loop free while the disk is slow,
+and has to keep working after the loop that submitted something is gone.
+"""
+
+
+# Seconds every slowed down statement takes
+SLOW = 0.3
+
+# The most the loop may fall behind while the database is slow
+MAX_LAG = 0.1
+
+# Seconds to wait on the worker before giving up on it
+TIMEOUT = 5
+
+
+def slow_down(connection):
+    """
+    Makes every statement on the connection stall like a slow disk would.
+    """
+
+    connection.create_function("stall", 0, lambda: time.sleep(SLOW))
+
+
+def stalled_write(connection, value):
+    connection.execute("create table if not exists slow (value)")
+    connection.execute("insert into slow select ? from (select stall())",
+                       (value,))
+    connection.commit()
+
+
+def count_rows(connection):
+    return connection.execute("select count(*) from slow").fetchone()[0]
+
+
+class TestDBWorker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.worker = DBWorker(os.path.join(self.directory.name, "test.db"))
+
+    def tearDown(self):
+        self.worker.close()
+        self.directory.cleanup()
+
+    def test_loop_stays_responsive(self):
+        """
+        Other tasks keep running on time while the worker is stuck on slow
+        database work.
+        """
+
+        async def ticker(lags, done):
+            loop = asyncio.get_running_loop()
+            while not done.is_set():
+                expected = loop.time() + 0.01
+                await asyncio.sleep(0.01)
+                lags.append(loop.time() - expected)
+
+        async def run():
+            await self.worker.run(slow_down)
+
+            lags = []
+            done = asyncio.Event()
+            ticks = asyncio.create_task(ticker(lags, done))
+
+            started = time.perf_counter()
+            for value in range(3):
+                await self.worker.run(stalled_write, value)
+            elapsed = time.perf_counter() - started
+
+            done.set()
+            await ticks
+            return elapsed, lags, await self.worker.run(count_rows)
+
+        elapsed, lags, rows = asyncio.run(run())
+
+        self.assertGreaterEqual(elapsed, 3 * SLOW)
+        self.assertEqual(rows, 3)
+        # The loop ticked the whole time instead of waiting on the disk
+        self.assertGreater(len(lags), elapsed / 0.01 / 2)
+        self.assertLess(max(lags), MAX_LAG)
+
+    def test_survives_closed_loop(self):
+        """
+        Work finishing after its loop closed doesn't stop the worker from
+        running what was queued after it.
+        """
+
+        async def submit():
+            await self.worker.run(slow_down)
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.worker.requests.put((stalled_write, (0,), future, loop))
+
+        # The loop closes while the write is still stalled
+        asyncio.run(submit())
+
+        self.worker.put(stalled_write, 1)
+
+        # A dead worker would never answer
+        rows = asyncio.run(asyncio.wait_for(self.worker.run(count_rows),
+                                            TIMEOUT))
+        self.assertEqual(rows, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import unittest
+
+from utils import reloader
+from utils.rolling import render, sr3e  # noqa: F401
+
+
+"""
+Reloading has to rerun modules in the order they import each other, and has
+to catch every module left holding names out of a reloaded one.
+"""
+
+
+class TestReloader(unittest.TestCase):
+    def test_imports_come_first(self):
+        graph = reloader.import_graph()
+        order = [module.__name__ for module in
+                 reloader.dependencies(sr3e, graph)]
+
+        self.assertLess(order.index("utils.rolling.parsers"),
+                        order.index("utils.rolling.render"))
+        self.assertLess(order.index("utils.rolling.result"),
+                        order.index("utils.rolling.render"))
+
+    def test_names_imported_out_of_modules(self):
+        imported = reloader.imports(render)
+
+        # "from utils.rolling.parsers import SR3_HELP" binds a name
+        self.assertTrue(imported["utils.rolling.parsers"])
+        self.assertNotIn("utils.rolling", imported)
+
+    def test_importers_are_found(self):
+        graph = {
+            "utils.a": {},
+            "utils.b": {"utils.a": True},
+            "utils.c": {"utils.b": True},
+            "utils.d": {"utils.a": False},
+            "cogs.e": {"utils.c": True},
+            "bot": {"utils.a": True, "utils.d": False},
+        }
+
+        extra, others = reloader.importers({"utils.a"}, graph)
+
+        self.assertEqual(extra, {"utils.b", "utils.c"})
+        self.assertEqual(others, {"cogs.e", "bot"})
+        self.assertEqual(reloader.ordered({"utils.a", "utils.b", "utils.c"},
+                                          graph),
+                         ["utils.a", "utils.b", "utils.c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
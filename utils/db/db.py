@@ -7,67 +7,260 @@ Please see the license for any restrictions or rights granted to you by the
 License.
 """
 
+import asyncio
+import json
+import logging
 import sqlite3
 
+from utils import metrics
+from utils.db.worker import DBWorker
+from utils.rolling.result import RollResult
+
+
+"""
+Saved rolls are written behind. A save only records the roll in memory, and
+the saves made in the next few milliseconds are written together with one
+executemany and a single commit. A user saving again before then replaces
+their pending save, and reading a user's last roll sees their pending save
+first.
+
+Rolls are stored packed by RollResult.to_bytes, and come back out as a
+RollResult.
+"""
+
+
+# How long a save waits to be written with others, in seconds
+FLUSH_DELAY = 0.005
+
+# How many pending saves are written straight away
+FLUSH_ROWS = 256
+
+# Seconds before a failed write is retried, doubled each time it fails again
+# up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30
+
 
 class DBHandler():
     def __init__(self, db="shadowrun.db"):
         self.db = db
-        self.connection = sqlite3.connect(self.db)
-        self.rolling = RollingDB(self.connection)
+
+        # Every query runs on the worker's thread, never on the event loop
+        self.worker = DBWorker(self.db)
+        self.rolling = RollingDB(self.worker)
+        self.combat = CombatDB(self.worker)
+
+    def close(self):
+        self.rolling.close()
+        self.worker.close()
 
 
 class RollingDB():
-    def __init__(self, connection):
-        self.connection = connection
+    def __init__(self, worker):
+        self.worker = worker
+
+        # Saves not yet written, {userid: (roll, threshold)}
+        self.pending = {}
+        self.flush_task = None
+        self.retry_delay = RETRY_DELAY
 
+    @metrics.timed("db")
     async def get_last_roll(self, userid):
         """
         Searches the database to get the last roll by this user. If no roll
-        exists, returns None.
+        exists, returns (None, None).
 
         Parameters:
             userid: int
 
         Returns:
-            [roll] or None
+            (RollResult, threshold) or (None, None)
         """
 
-        cur = self.connection.cursor()
+        if userid in self.pending:
+            packed, threshold = self.pending[userid]
+            return RollResult.from_bytes(packed), threshold
 
-        try:
-            cur.execute("""
-            SELECT roll, threshold from rolls where userid = ?
-            """, (userid,))
+        def query(connection):
+            cur = connection.cursor()
 
-            self.connection.commit()
-            cur = cur.fetchall()
+            try:
+                cur.execute("""
+                SELECT roll, threshold from rolls where userid = ?
+                """, (userid,))
 
-            return cur[0]
-        except sqlite3.OperationalError:
-            return (None, None)
-        except IndexError:
+                connection.commit()
+                cur = cur.fetchall()
+
+                return cur[0]
+            except sqlite3.OperationalError:
+                return (None, None)
+            except IndexError:
+                return (None, None)
+
+        packed, threshold = await self.worker.run(query)
+        if packed is None:
             return (None, None)
 
+        return RollResult.from_bytes(packed), threshold
+
+    @metrics.timed("db")
     async def save_roll(self, userid, roll, threshold):
         """
         Saves the roll and the threshold information to the datavase.
 
         Parameters:
             userid: int
-            roll: [int, int, ..., int]
+            roll: RollResult
             threshold: int
 
         Return:
             None
         """
 
-        cur = self.connection.cursor()
+        self.pending[userid] = (roll.to_bytes(), threshold)
+
+        if len(self.pending) >= FLUSH_ROWS:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self, delay=FLUSH_DELAY):
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        await self.flush()
+
+    @metrics.timed("db")
+    async def flush(self):
+        """
+        Writes every pending save in a single transaction.
+        """
+
+        if not self.pending:
+            return
+
+        rows = self.take_pending()
+
+        try:
+            await self.worker.run(save_rolls, rows)
+        except sqlite3.Error:
+            logging.getLogger(__name__).exception(
+                f"Saving rolls failed, retrying in {self.retry_delay:g}s")
+
+            # Keep them for the next flush, unless saved again since
+            for userid, roll, threshold in rows:
+                self.pending.setdefault(userid, (roll, threshold))
+
+            # Retry without waiting on another save to come along
+            if self.flush_task is None:
+                self.flush_task = asyncio.ensure_future(
+                    self.flush_later(self.retry_delay))
+            self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+        else:
+            self.retry_delay = RETRY_DELAY
+
+    def take_pending(self):
+        rows = [(userid, roll, threshold)
+                for userid, (roll, threshold) in self.pending.items()]
+        self.pending = {}
+        return rows
+
+    def close(self):
+        """
+        Queues the pending saves to be written before the worker stops.
+        """
+
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+        if self.pending:
+            self.worker.put(save_rolls, self.take_pending())
+
 
-        roll = str(roll)
+def save_rolls(connection, rows):
+    connection.executemany("""
+    insert or replace into rolls (userid, roll, threshold) values (?, ?, ?)
+    """, rows)
+    connection.commit()
+
+
+class CombatDB():
+    def __init__(self, worker):
+        self.worker = worker
+
+    @metrics.timed("db")
+    async def get_combat(self, channel):
+        """
+        Gets the saved initiative tracker state for a channel. If no combat
+        is saved, returns None.
+
+        Parameters:
+            channel: int
+
+        Returns:
+            dict or None
+        """
+
+        def query(connection):
+            cur = connection.cursor()
+
+            try:
+                cur.execute("""
+                SELECT state from combat where channel = ?
+                """, (channel,))
+
+                cur = cur.fetchall()
+
+                return json.loads(cur[0][0])
+            except sqlite3.OperationalError:
+                return None
+            except IndexError:
+                return None
+
+        return await self.worker.run(query)
+
+    @metrics.timed("db")
+    async def save_combat(self, channel, state):
+        """
+        Saves the initiative tracker state for a channel.
+
+        Parameters:
+            channel: int
+            state: dict
+
+        Return:
+            None
+        """
+
+        state = json.dumps(state)
+
+        def query(connection):
+            cur = connection.cursor()
+
+            cur.execute("""
+            insert or replace into combat (channel, state) values (?, ?)
+            """, (channel, state,))
+
+            connection.commit()
+
+        await self.worker.run(query)
+
+    @metrics.timed("db")
+    async def delete_combat(self, channel):
+        """
+        Removes the saved combat for a channel.
+
+        Parameters:
+            channel: int
+
+        Return:
+            None
+        """
 
-        cur.execute("""
-        insert or replace into rolls (userid, roll, threshold) values (?, ?, ?)
-        """, (userid, roll, threshold,))
+        def query(connection):
+            cur = connection.cursor()
+            cur.execute("delete from combat where channel = ?", (channel,))
+            connection.commit()
 
-        self.connection.commit()
+        await self.worker.run(query)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/rollbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from utils.db.migrations.abc import abc_migration
+
+
+class Migration(abc_migration.Migration):
+    def __init__(self, db="shadowrun.db"):
+        super().__init__(db)
+        self.version = 1
+        self.description = "Adds a table to persist initiative tracking"
+        self.breaks = "Combats are lost when the bot restarts."
+
+    def migrate(self):
+        """
+        Creates the combat table, holding the initiative tracker of each
+        channel as JSON.
+        """
+
+        cursor = self.connection.cursor()
+
+        combat = '''CREATE TABLE if not exists combat (
+                    channel INTEGER primary key not null unique,
+                    state TEXT
+                    )'''
+
+        cursor.execute(combat)
+        self.connection.commit()
+
+        self.upgrade_table_version("combat")
+        self.upgrade_table_version("schema")
+
+        self.migrated = True
+
+    def revert(self):
+        """
+        Removes the combat table
+        """
+
+        cursor = self.connection.cursor()
+        cursor.execute("drop table combat")
+
+        self.downgrade_table_version("combat")
+        self.downgrade_table_version("schema")
+        self.connection.commit()
+
+        self.migrated = False
+
+    def requisites(self):
+        """
+        Always returns True. This migration only adds a table.
+        """
+        return True
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/rollbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from utils.db.migrations.abc import abc_migration
+from utils.rolling.result import RollResult
+
+
+# How many saved rolls are converted at a time
+BATCH = 1000
+
+
+class Migration(abc_migration.Migration):
+    def __init__(self, db="shadowrun.db"):
+        super().__init__(db)
+        self.version = 2
+        self.description = "Stores saved rolls as packed histograms"
+        self.breaks = "Rerolls can't read rolls saved by newer versions."
+
+    def migrate(self):
+        """
+        Copies the rolls table into one storing each roll as a BLOB packed by
+        RollResult.to_bytes, a batch of rows at a time, then swaps it in.
+        """
+
+        self.copy_rolls(lambda text: RollResult(parse_text(text)).to_bytes(),
+                        "BLOB")
+
+        self.upgrade_table_version("rolls")
+        self.upgrade_table_version("schema")
+
+        self.migrated = True
+
+    def revert(self):
+        """
+        Turns the saved rolls back into text.
+        """
+
+        self.copy_rolls(lambda packed: str(RollResult.from_bytes(packed)),
+                        "TEXT")
+
+        self.downgrade_table_version("rolls")
+        self.downgrade_table_version("schema")
+        self.connection.commit()
+
+        self.migrated = False
+
+    def copy_rolls(self, convert, column):
+        """
+        Rebuilds the rolls table with the roll column converted. Rows are
+        read in batches by userid, so the whole table never has to be held in
+        memory.
+        """
+
+        cursor = self.connection.cursor()
+
+        # Left behind if an earlier attempt was interrupted
+        cursor.execute("drop table if exists rolls_new")
+        cursor.execute(f'''CREATE TABLE rolls_new (
+                           userid INTEGER primary key not null unique,
+                           roll {column},
+                           threshold integer default 4,
+                           unique(userid)
+                           )''')
+
+        last = None
+        while True:
+            if last is None:
+                cursor.execute("""select userid, roll, threshold from rolls
+                               order by userid limit ?""", (BATCH,))
+            else:
+                cursor.execute("""select userid, roll, threshold from rolls
+                               where userid > ? order by userid limit ?""",
+                               (last, BATCH))
+
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            converted = []
+            for userid, roll, threshold in rows:
+                try:
+                    roll = convert(roll) if roll is not None else None
+                except (ValueError, TypeError, IndexError):
+                    roll = None
+                converted.append((userid, roll, threshold))
+
+            cursor.executemany("""insert into rolls_new
+                               (userid, roll, threshold) values (?, ?, ?)""",
+                               converted)
+            last = rows[-1][0]
+
+        cursor.execute("drop table rolls")
+        cursor.execute("alter table rolls_new rename to rolls")
+        self.connection.commit()
+
+    def requisites(self):
+        """
+        Always returns True. The rolls table exists since the first
+        migration.
+        """
+        return True
+
+
+def parse_text(text):
+    """
+    Reads a roll saved as the text of a list, such as "[1, 4, 4, 9]".
+    """
+
+    text = text.strip("[]")
+    if not text:
+        return []
+    return [int(roll) for roll in text.split(", ")]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+
+
+"""
+A thread owning the database connection.
+
+sqlite3 blocks while it reads, writes and syncs to disk, which would stall the
+event loop and every guild with it. Instead, all database work is handed to a
+single worker thread as a function taking the connection. The worker runs the
+functions one at a time, in the order they were submitted, and hands each
+result back to the event loop through a future.
+
+The connection runs in WAL mode, where readers don't wait on the writer and
+a commit only appends to the log, with the pragmas below tuned to match.
+"""
+
+
+# Seconds a connection waits on a database locked by another process before
+# giving up. Clusters share one database file.
+BUSY_TIMEOUT = 30
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # In WAL mode NORMAL only syncs at checkpoints and can't corrupt the
+    # database, at worst the last commits are lost on a power cut
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+
+class DBWorker():
+    """
+    Runs functions against a connection on a thread of its own.
+    """
+
+    def __init__(self, db, timeout=BUSY_TIMEOUT):
+        self.db = db
+        self.timeout = timeout
+        self.requests = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.work, name="db-worker",
+                                       daemon=True)
+        self.thread.start()
+
+    def work(self):
+        connection = sqlite3.connect(self.db, timeout=self.timeout)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            function, args, future, loop = request
+            try:
+                result = function(connection, *args)
+            except Exception as error:
+                if future is None:
+                    logging.getLogger(__name__).exception(
+                        "Database work failed")
+                else:
+                    _resolve(loop, _set_exception, future, error)
+            else:
+                if future is not None:
+                    _resolve(loop, _set_result, future, result)
+
+        connection.close()
+
+    async def run(self, function, *args):
+        """
+        Runs function(connection, *args) on the worker thread.
+
+        Parameters:
+            function: a function taking the connection as its first argument
+            args: the rest of its arguments
+
+        Returns:
+            whatever the function returns
+        """
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.requests.put((function, args, future, loop))
+        return await future
+
+    def put(self, function, *args):
+        """
+        Queues function(connection, *args) without waiting for it. Works
+        without an event loop, so it can be used while shutting down.
+        """
+
+        self.requests.put((function, args, None, None))
+
+    def close(self):
+        """
+        Finishes everything already submitted, then closes the connection.
+        """
+
+        self.requests.put(None)
+        self.thread.join()
+
+
+def _resolve(loop, callback, future, value):
+    """
+    Hands a result back to the loop that asked for it. Nobody is waiting on
+    a loop that has closed in the meantime, such as after the bot stopped,
+    and the worker has to carry on with the rest of the queue regardless.
+    """
+
+    if loop.is_closed():
+        return
+
+    try:
+        loop.call_soon_threadsafe(callback, future, value)
+    except RuntimeError:
+        # The loop closed after the check
+        pass
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
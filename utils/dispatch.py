@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+
+"""
+The front end of on_message. Nearly every message the bot sees is ordinary
+chat, so the first thing done with a message is a check cheap enough to run
+on all of them: the first character against the prefix, and a substring
+search for an inline command. Only messages passing it are looked at again.
+"""
+
+
+INLINE_MARKER = "{%"
+
+
+class DispatchStats():
+    """
+    Counts what happened to the messages the bot has seen.
+    """
+
+    __slots__ = ("seen", "rejected", "dispatched", "inline", "throttled")
+
+    def __init__(self):
+        self.seen = 0
+        self.rejected = 0
+        self.dispatched = 0
+        self.inline = 0
+        self.throttled = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def is_candidate(content, prefix):
+    """
+    Checks whether a message could hold a command.
+
+    Parameters:
+        content: str
+        prefix: str
+
+    Returns:
+        bool
+    """
+
+    return content[:1] == prefix[:1] or INLINE_MARKER in content
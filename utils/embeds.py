@@ -38,3 +38,57 @@ async def build_embed(ctx, title, message, footer=None, color=Colour.blue()):
         embed.set_footer(text=footer)
 
     return embed
+
+
+# The longest description Discord accepts in an embed
+DESCRIPTION_LIMIT = 4096
+
+
+async def combine_embeds(ctx, replies, footer="Inline Commands",
+                         color=Colour.blue()):
+    """
+    Packs several replies into as few embeds as possible, keeping them in
+    order.
+
+    Parameters:
+        ctx: discord.py ctx object
+        replies: [[command, content, embed], ...]
+            command: str, used as the heading if the embed has no title
+            content: str or None
+            embed: Embed or None
+        footer: str
+        color: discord.color.Colour
+
+    Returns:
+        [Embed, Embed..., Embed]
+    """
+
+    sections = []
+    for command, content, embed in replies:
+        title = command
+        body = [content] if content else []
+
+        if embed is not None:
+            title = embed.title or command
+            if embed.description:
+                body.append(embed.description)
+            if embed.footer.text:
+                body.append(f"*{embed.footer.text}*")
+
+        section = f"**{title}**\n" + "\n".join(body)
+        if len(section) > DESCRIPTION_LIMIT:
+            section = section[:DESCRIPTION_LIMIT - 1] + "…"
+        sections.append(section)
+
+    descriptions = []
+    current = ""
+    for section in sections:
+        if current and len(current) + len(section) + 1 > DESCRIPTION_LIMIT:
+            descriptions.append(current)
+            current = ""
+        current = f"{current}\n{section}" if current else section
+    descriptions.append(current)
+
+    return [await build_embed(ctx, None, description, footer=footer,
+                              color=color)
+            for description in descriptions]
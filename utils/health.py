@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import time
+
+from collections import deque
+from utils import metrics
+
+
+"""
+Watches how late the event loop gets around to things.
+
+The watchdog sleeps for a fixed interval over and over, and measures how much
+later than asked it woke up. That lag is the time callbacks spent hogging the
+loop, and is exactly what players feel as a slow roll. The recent lags are
+kept for percentiles, and a warning naming the commands in flight is logged
+when the lag goes over the threshold.
+"""
+
+
+# Seconds between measurements
+INTERVAL = 0.5
+
+# Lag in seconds worth a warning
+THRESHOLD = 0.25
+
+# Seconds between two warnings, so a saturated loop doesn't flood the log
+WARN_INTERVAL = 10
+
+# How many measurements are kept, ten minutes at the default interval
+SAMPLES = 1200
+
+
+class Watchdog():
+    """
+    Measures event loop lag in the background.
+    """
+
+    def __init__(self, bot, interval=INTERVAL, threshold=THRESHOLD):
+        self.bot = bot
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=SAMPLES)
+        self.last_warning = 0
+        self.task = None
+
+    def start(self, loop):
+        self.task = loop.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.lags.append(lag)
+
+            if lag > self.threshold:
+                self.warn(lag)
+
+    def warn(self, lag):
+        now = time.monotonic()
+        if now - self.last_warning < WARN_INTERVAL:
+            return
+        self.last_warning = now
+
+        self.bot.logger.warning(f"Event loop lagged {lag * 1000:.0f}ms. "
+                                f"In flight: {in_flight_text()}")
+
+    def percentile(self, percentile):
+        """
+        Returns the lag at a percentile of the recent measurements, in
+        seconds.
+        """
+
+        if not self.lags:
+            return 0.0
+
+        ordered = sorted(self.lags)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    @property
+    def current(self):
+        return self.lags[-1] if self.lags else 0.0
+
+
+def in_flight_text():
+    """
+    Lists the commands running right now with how long they've been running.
+    """
+
+    now = time.perf_counter()
+    running = sorted(metrics.METRICS.in_flight.values(),
+                     key=lambda command: command[1])
+
+    if not running:
+        return "nothing"
+
+    return ", ".join(f"{name} ({(now - start) * 1000:.0f}ms)"
+                     for name, start in running)
+
+
+async def format_health(bot):
+    """
+    Formats the health of the bot in an easy to read fashion.
+
+    Parameters:
+        bot: commands.Bot
+
+    Returns:
+        message: str
+    """
+
+    uptime = time.perf_counter() - bot.started
+    hours, remainder = divmod(int(uptime), 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    latency = bot.latency * 1000
+    latency = "not connected" if latency != latency else f"{latency:.0f}ms"
+
+    lines = [
+        f"Uptime: {hours}h {minutes}m {seconds}s",
+        f"Gateway latency: {latency}",
+    ]
+
+    watchdog = getattr(bot, "watchdog", None)
+    if watchdog is not None:
+        lines.append("Loop lag: "
+                     f"now {watchdog.current * 1000:.1f}ms, "
+                     f"p50 {watchdog.percentile(50) * 1000:.1f}ms, "
+                     f"p99 {watchdog.percentile(99) * 1000:.1f}ms, "
+                     f"max {max(watchdog.lags, default=0) * 1000:.1f}ms")
+
+    lines.append(f"Pending tasks: {len(asyncio.all_tasks())}")
+    lines.append(f"In flight: {in_flight_text()}")
+
+    return "```\n" + "\n".join(lines) + "\n```"
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import copy
+import re
+
+from discord.ext import commands
+from utils import throttle
+from utils.embeds import build_embed, combine_embeds
+
+
+"""
+Inline commands are commands written inside {% %} anywhere in a message, such
+as "I shoot him {% roll 8 4 %} and dive for cover {% r 6 %}".
+
+Each inline command runs against its own copy of the message with a context
+that collects its replies instead of sending them. The commands run
+concurrently, and once they have all finished their replies are sent back in
+order through the bot's outbox as a single combined embed whenever possible.
+"""
+
+
+INLINE = re.compile("{%(.*?)%}")
+
+# How many inline commands from one message may run at the same time
+CONCURRENCY = 4
+
+# The most inline commands a single message may contain
+MAX_COMMANDS = 20
+
+
+class CollectingContext(commands.Context):
+    """
+    A context that keeps everything sent to it instead of sending it.
+    """
+
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        self.replies = []
+
+    async def send(self, content=None, *, embed=None, file=None, **kwargs):
+        if content is not None:
+            content = str(content)
+        self.replies.append([content, embed, file])
+
+
+class _AwaitedErrors():
+    """
+    Stands in for the bot while a command's errors are dispatched, holding
+    back the command_error event so the bot's handler can be awaited instead.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def __getattr__(self, name):
+        return getattr(self.bot, name)
+
+    def dispatch(self, event, *args, **kwargs):
+        if event != "command_error":
+            self.bot.dispatch(event, *args, **kwargs)
+
+
+async def dispatch_error(bot, ctx, error):
+    """
+    Runs the command's and cog's error handlers through
+    Command.dispatch_error, then the bot's own handler. The bot's handler is
+    awaited rather than dispatched as a separate event, which would answer
+    after the replies had been sent.
+    """
+
+    if ctx.command is not None:
+        ctx.bot = _AwaitedErrors(bot)
+        try:
+            await ctx.command.dispatch_error(ctx, error)
+        finally:
+            ctx.bot = bot
+
+    await bot.on_command_error(ctx, error)
+
+
+async def invoke(bot, ctx):
+    """
+    Invokes a command the same way Bot.invoke does, except errors go through
+    dispatch_error so every handler answers before the replies are sent.
+    """
+
+    if ctx.command is None:
+        error = commands.CommandNotFound(f'Command "{ctx.invoked_with}" is '
+                                         'not found')
+        return await dispatch_error(bot, ctx, error)
+
+    bot.dispatch('command', ctx)
+    try:
+        if await bot.can_run(ctx, call_once=True):
+            await ctx.command.invoke(ctx)
+        else:
+            raise commands.CheckFailure("The global check once functions "
+                                        "failed.")
+    except commands.CommandError as error:
+        await dispatch_error(bot, ctx, error)
+    else:
+        bot.dispatch('command_completion', ctx)
+
+
+def find_inline(content):
+    """
+    Gets the inline commands in a message.
+
+    Parameters:
+        content: str
+
+    Returns:
+        [str, str..., str]
+    """
+
+    return INLINE.findall(content)[:MAX_COMMANDS]
+
+
+async def run_inline(bot, message, inline):
+    """
+    Runs the inline commands of a message concurrently and sends their
+    replies combined.
+
+    Parameters:
+        bot: commands.Bot
+        message: discord.Message
+        inline: [str, str..., str]
+    """
+
+    limit = asyncio.Semaphore(CONCURRENCY)
+
+    async def run(command):
+        command = command.strip()
+        if not command.startswith(bot.command_prefix):
+            command = bot.command_prefix + command
+
+        copied = copy.copy(message)
+        copied.content = command
+
+        async with limit:
+            ctx = await bot.get_context(copied, cls=CollectingContext)
+            if await throttle.admit(bot, ctx):
+                await invoke(bot, ctx)
+
+        return ctx
+
+    contexts = await asyncio.gather(*[run(command) for command in inline])
+
+    # Replies with a file can't be combined, so they are sent on their own
+    # between the combined replies before and after them
+    replies = []
+    for ctx in contexts:
+        for content, embed, file in ctx.replies:
+            if file:
+                await send_combined(bot, message.channel, contexts[0],
+                                    replies)
+                replies = []
+                await bot.outbox.send(message.channel, content, embed=embed,
+                                      file=file)
+            else:
+                replies.append([ctx.message.content, content, embed])
+
+    await send_combined(bot, message.channel, contexts[0], replies)
+
+
+async def send_combined(bot, channel, ctx, replies):
+    """
+    Sends replies combined into as few messages as possible.
+
+    Parameters:
+        bot: commands.Bot
+        channel: discord.abc.Messageable
+        ctx: commands.Context, used to build the embeds
+        replies: [[command, content, embed], ...]
+    """
+
+    if not replies:
+        return
+
+    if len(replies) == 1 and replies[0][2] is None:
+        return await bot.outbox.send(channel, replies[0][1])
+
+    for embed in await combine_embeds(ctx, replies):
+        await bot.outbox.send(channel, embed=embed)
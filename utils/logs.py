@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from utils import metrics
+
+
+"""
+Logging that never blocks the event loop.
+
+The root logger only has a QueueHandler, which puts records on a queue and
+returns. A QueueListener on a background thread takes them off the queue and
+does the formatting and writing, to stdout and optionally to a file rotated
+by size. A slow pipe or disk then only ever holds up the listener.
+
+Records logged while a command runs are tagged with the command and guild.
+Lines can be written as plain text or as one JSON object each.
+
+Everything is configured under "logging" in config/config.json:
+
+    "logging": {
+        "level": "INFO",
+        "levels": {"discord": "WARNING"},
+        "json": false,
+        "file": null,
+        "max_bytes": 10485760,
+        "backups": 5
+    }
+"""
+
+
+FORMAT = '%(asctime)s %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 5
+
+# Record attributes copied into JSON lines when they are set
+FIELDS = ("command", "guild", "latency")
+
+
+class ContextFilter(logging.Filter):
+    """
+    Tags records with the command and guild being handled when they were
+    logged. Runs in the thread doing the logging, where they are known.
+    """
+
+    def filter(self, record):
+        if getattr(record, "command", None) is None:
+            record.command = metrics.current.get()
+        if getattr(record, "guild", None) is None:
+            record.guild = metrics.current_guild.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as a single line of JSON.
+    """
+
+    def format(self, record):
+        line = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                line[field] = value
+
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(line)
+
+
+def setup(config):
+    """
+    Sets up queued logging for the whole process. Calling it again, when the
+    bot restarts, only updates the levels.
+
+    Parameters:
+        config: dict, the "logging" section of the config
+
+    Returns:
+        logging.Logger, the root logger
+    """
+
+    logger = logging.getLogger()
+    logger.setLevel(config.get("level", "INFO"))
+
+    for name, level in config.get("levels", {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
+
+    if config.get("json"):
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter(FORMAT, datefmt=DATE_FORMAT)
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if config.get("file"):
+        handlers.append(RotatingFileHandler(
+            config["file"], maxBytes=config.get("max_bytes", MAX_BYTES),
+            backupCount=config.get("backups", BACKUPS), encoding="utf-8"))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    return logger
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+
+from array import array
+from contextlib import contextmanager
+
+
+"""
+Counters and latency histograms for commands and the stages they go through.
+
+Every command is timed from its before_invoke hook to its after_invoke hook.
+While it runs, the command's name is kept in a context variable, so the stage
+timers around the database, the quote site, the dice and sending replies
+know which command they are timing without anything being passed to them.
+
+Histograms are HDR style: values are kept in microseconds, exactly up to 32
+and in 16 buckets per power of two above that, so every recorded value is
+within about 6% of its bucket no matter how large it is. Recording a value is
+a bit_length and an array increment.
+
+Everything can be exported in the Prometheus text format, served on
+localhost or written to a file.
+"""
+
+
+# Values below 2 ** SUB_BITS get a bucket each
+SUB_BITS = 5
+HALF = 1 << (SUB_BITS - 1)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# How often the export file is rewritten, in seconds
+EXPORT_INTERVAL = 15
+
+
+class Histogram():
+    """
+    A log-linear histogram of durations in microseconds.
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = array('Q')
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        Records a duration in seconds.
+        """
+
+        value = int(value * 1_000_000)
+        shift = max(value.bit_length() - SUB_BITS, 0)
+        index = HALF * shift + (value >> shift)
+
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """
+        Returns the duration at a percentile, in seconds.
+        """
+
+        if not self.count:
+            return 0.0
+
+        wanted = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(bucket_value(index), self.max) / 1_000_000
+
+        return self.max / 1_000_000
+
+    @property
+    def mean(self):
+        return self.total / self.count / 1_000_000 if self.count else 0.0
+
+
+def bucket_value(index):
+    """
+    Returns the highest value a histogram bucket holds.
+    """
+
+    if index < 2 * HALF:
+        return index
+
+    shift = index // HALF - 1
+    return ((index - HALF * shift + 1) << shift) - 1
+
+
+class Metrics():
+    """
+    Every counter and histogram the bot keeps.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.stages = {}
+        self.counters = {}
+        self.in_flight = {}
+
+    def histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram()
+        return histogram
+
+    def count(self, name, label="", amount=1):
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record_stage(self, stage, elapsed):
+        command = current.get()
+        self.histogram(self.stages, (command or "", stage)).record(elapsed)
+
+
+# Reloading the module keeps everything recorded so far
+if "METRICS" not in globals():
+    METRICS = Metrics()
+    current = contextvars.ContextVar("command", default=None)
+    current_guild = contextvars.ContextVar("guild", default=None)
+
+
+async def start_command(ctx):
+    """
+    Starts timing a command. Used as the bot's before_invoke hook.
+    """
+
+    name = ctx.command.qualified_name
+    ctx.metrics_start = time.perf_counter()
+    ctx.metrics_token = current.set(name)
+    ctx.metrics_guild_token = current_guild.set(
+        ctx.guild.id if ctx.guild else None)
+    METRICS.in_flight[id(ctx)] = (name, ctx.metrics_start)
+
+
+async def finish_command(ctx):
+    """
+    Stops timing a command. Used as the bot's after_invoke hook.
+    """
+
+    start = getattr(ctx, "metrics_start", None)
+    if start is None:
+        return
+
+    name = ctx.command.qualified_name
+    elapsed = time.perf_counter() - start
+    METRICS.histogram(METRICS.commands, name).record(elapsed)
+    METRICS.count("commands", name)
+    if ctx.command_failed:
+        METRICS.count("errors", name)
+
+    METRICS.in_flight.pop(id(ctx), None)
+
+    logging.getLogger("srbot.commands").debug(
+        f"{name} took {elapsed * 1000:.1f}ms",
+        extra={"latency": round(elapsed * 1000, 3)})
+
+    current.reset(ctx.metrics_token)
+    current_guild.reset(ctx.metrics_guild_token)
+
+
+@contextmanager
+def timer(stage):
+    """
+    Times a stage of whatever command is running.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.record_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """
+    Decorates a function, async or not, so every call is timed as a stage.
+    """
+
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    METRICS.record_stage(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    METRICS.record_stage(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def summary(name, labels, histogram):
+    """
+    Formats a histogram as a Prometheus summary.
+    """
+
+    lines = []
+    for quantile in QUANTILES:
+        quantile_labels = labels + [f'quantile="{quantile}"']
+        lines.append(f"{name}{{{','.join(quantile_labels)}}} "
+                     f"{histogram.percentile(quantile * 100):.6f}")
+
+    label_text = f"{{{','.join(labels)}}}" if labels else ""
+    lines.append(f"{name}_sum{label_text} {histogram.total / 1_000_000:.6f}")
+    lines.append(f"{name}_count{label_text} {histogram.count}")
+    return lines
+
+
+def export(bot):
+    """
+    Renders every metric in the Prometheus text format.
+
+    Parameters:
+        bot: commands.Bot
+
+    Returns:
+        str
+    """
+
+    lines = ["# TYPE srbot_command_seconds summary"]
+    for name, histogram in sorted(METRICS.commands.items()):
+        lines += summary("srbot_command_seconds", [f'command="{name}"'],
+                         histogram)
+
+    lines.append("# TYPE srbot_stage_seconds summary")
+    for (command, stage), histogram in sorted(METRICS.stages.items()):
+        lines += summary("srbot_stage_seconds",
+                         [f'command="{command}"', f'stage="{stage}"'],
+                         histogram)
+
+    names = sorted({name for name, _ in METRICS.counters})
+    for name in names:
+        lines.append(f"# TYPE srbot_{name}_total counter")
+        for (counter, label), value in sorted(METRICS.counters.items()):
+            if counter == name:
+                lines.append(f'srbot_{name}_total{{command="{label}"}} '
+                             f"{value}")
+
+    lines.append("# TYPE srbot_messages_total counter")
+    for outcome, value in bot.dispatch_stats.as_dict().items():
+        lines.append(f'srbot_messages_total{{outcome="{outcome}"}} {value}')
+
+    queued, _ = bot.outbox.depth()
+    lines.append("# TYPE srbot_outbox_queued gauge")
+    lines.append(f"srbot_outbox_queued {queued}")
+    lines.append("# TYPE srbot_commands_in_flight gauge")
+    lines.append(f"srbot_commands_in_flight {len(METRICS.in_flight)}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def serve(bot, port=None, path=None, interval=EXPORT_INTERVAL):
+    """
+    Exports the metrics over HTTP on localhost, to a file, or both. Runs until
+    cancelled when writing to a file.
+
+    Parameters:
+        bot: commands.Bot
+        port: int or None
+        path: str or None
+        interval: float
+    """
+
+    if port:
+        # Only the HTTP exporter needs aiohttp, so importing metrics stays cheap
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=export(bot),
+                                content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        bot.logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    while path:
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as export_file:
+            export_file.write(export(bot))
+        os.replace(temporary, path)
+        await asyncio.sleep(interval)
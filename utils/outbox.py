@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import time
+
+from collections import deque
+from discord.ext import commands
+from utils import metrics, throttle
+from utils.embeds import DESCRIPTION_LIMIT, combine_embeds
+
+
+"""
+The outbox every reply goes through on its way to Discord.
+
+Replies are queued per channel, and each channel with something queued has a
+single task sending its replies in order. The outbox keeps its own token
+bucket for each channel, sized to Discord's limit on messages sent to one
+channel, so a burst of replies waits here instead of behind 429 backoffs in
+the HTTP client.
+
+A reply waits a short window before it is sent. Replies queued for the same
+channel by the same user in the meantime are merged with it: plain text is
+joined, and anything with an embed is packed into combined embeds the same
+way inline commands are. Replies with files or extra options are sent on
+their own.
+
+The function actually sending a message can be swapped out, which is how the
+outbox is tested without a connection to Discord.
+"""
+
+
+# How long a reply waits for others to merge with, in seconds
+WINDOW = 0.05
+
+# Discord allows 5 messages per channel every 5 seconds
+CHANNEL_LIMIT = (5, 1.0)
+
+# The longest message content Discord accepts
+CONTENT_LIMIT = 2000
+
+# How many send latencies are kept for the statistics
+LATENCY_SAMPLES = 1000
+
+
+class Pending():
+    """
+    A reply waiting in the outbox.
+    """
+
+    __slots__ = ("content", "embed", "file", "ctx", "kwargs", "future",
+                 "queued")
+
+    def __init__(self, content, embed, file, ctx, kwargs, future, queued):
+        self.content = content
+        self.embed = embed
+        self.file = file
+        self.ctx = ctx
+        self.kwargs = kwargs
+        self.future = future
+        self.queued = queued
+
+    @property
+    def author(self):
+        if self.ctx is None or self.file is not None or self.kwargs:
+            return None
+        return self.ctx.message.author.id
+
+    def __len__(self):
+        length = len(self.content or "")
+        if self.embed is not None:
+            length += len(self.embed.description or "") + \
+                len(self.embed.title or "") + len(self.embed.footer.text or "")
+        return length
+
+
+async def channel_send(channel, content=None, **kwargs):
+    """
+    Sends a message the way discord.py does.
+    """
+
+    return await channel.send(content, **kwargs)
+
+
+class Outbox():
+    """
+    Per channel reply queues and the tasks draining them.
+    """
+
+    def __init__(self, sender=channel_send, window=WINDOW,
+                 limit=CHANNEL_LIMIT, clock=time.monotonic):
+        self.sender = sender
+        self.window = window
+        self.clock = clock
+        self.buckets = throttle.Throttle({"channel": limit}, clock=clock)
+        self.queues = {}
+        self.workers = {}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.merged = 0
+
+    async def send(self, channel, content=None, *, embed=None, file=None,
+                   ctx=None, **kwargs):
+        """
+        Queues a reply and waits until it has been sent.
+
+        Parameters:
+            channel: discord.abc.Messageable
+            content: str or None
+            embed: discord.Embed or None
+            file: discord.File or None
+            ctx: commands.Context or None, needed for the reply to be merged
+            kwargs: any other options for channel.send
+
+        Returns:
+            discord.Message the reply was sent in
+        """
+
+        if content is not None:
+            content = str(content)
+
+        future = asyncio.get_event_loop().create_future()
+        pending = Pending(content, embed, file, ctx, kwargs, future,
+                          self.clock())
+
+        self.queues.setdefault(channel.id, deque()).append(pending)
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.ensure_future(
+                self.drain(channel))
+
+        return await future
+
+    async def drain(self, channel):
+        """
+        Sends everything queued for a channel, then exits.
+        """
+
+        queue = self.queues[channel.id]
+
+        try:
+            while queue:
+                # Only a lone reply waits, anything backed up is sent at once
+                if len(queue) == 1:
+                    await asyncio.sleep(self.window)
+
+                wait = self.buckets.take({"channel": channel.id}, 1)
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = self.buckets.take({"channel": channel.id}, 1)
+
+                await self.deliver(channel, next_batch(queue))
+        finally:
+            del self.workers[channel.id]
+            if not queue:
+                del self.queues[channel.id]
+
+    async def deliver(self, channel, batch):
+        """
+        Sends a batch of replies as one message, resolving their futures.
+        """
+
+        first = batch[0]
+
+        try:
+            if len(batch) == 1:
+                message = await self.sender(channel, first.content,
+                                            embed=first.embed,
+                                            file=first.file, **first.kwargs)
+            elif all(pending.embed is None for pending in batch):
+                content = "\n".join(pending.content for pending in batch
+                                    if pending.content)
+                message = await self.sender(channel, content)
+            else:
+                replies = [[pending.ctx.message.content, pending.content,
+                            pending.embed] for pending in batch]
+                embeds = await combine_embeds(first.ctx, replies,
+                                              footer="Combined Replies")
+                for embed in embeds:
+                    message = await self.sender(channel, embed=embed)
+        except Exception as error:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(error)
+            return
+
+        now = self.clock()
+        self.sent += 1
+        self.merged += len(batch) - 1
+        for pending in batch:
+            self.latencies.append(now - pending.queued)
+            if not pending.future.done():
+                pending.future.set_result(message)
+
+    def depth(self):
+        """
+        Returns how many replies are waiting, in total and in the most backed
+        up channel.
+        """
+
+        depths = [len(queue) for queue in self.queues.values()]
+        return sum(depths), max(depths, default=0)
+
+    def latency(self, percentile):
+        """
+        Returns the send latency at a percentile of the recent replies, in
+        seconds.
+        """
+
+        if not self.latencies:
+            return 0.0
+
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+def next_batch(queue):
+    """
+    Takes the replies that can be merged with the first one off the queue.
+
+    Parameters:
+        queue: deque of Pending
+
+    Returns:
+        [Pending, Pending..., Pending]
+    """
+
+    first = queue.popleft()
+    batch = [first]
+
+    author = first.author
+    if author is None:
+        return batch
+
+    text_only = first.embed is None
+    length = len(first)
+
+    while queue and queue[0].author == author:
+        pending = queue[0]
+        text_only = text_only and pending.embed is None
+        length += len(pending) + 1
+
+        limit = CONTENT_LIMIT if text_only else DESCRIPTION_LIMIT
+        if length > limit:
+            break
+
+        batch.append(queue.popleft())
+
+    return batch
+
+
+class QueuedContext(commands.Context):
+    """
+    A context sending its replies through the bot's outbox.
+    """
+
+    @metrics.timed("send")
+    async def send(self, content=None, **kwargs):
+        return await self.bot.outbox.send(self.channel, content, ctx=self,
+                                          **kwargs)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import re
+
+
+"""
+Finding out what is holding up the event loop.
+
+A profile runs cProfile on the event loop's thread for a while. Everything the
+loop runs in that time, every handler and every callback, ends up in the
+report, sorted by cumulative time.
+
+Slow callback reporting puts the loop in debug mode, where asyncio logs every
+callback running longer than a threshold. The task running a command is named
+after it, "cmd:roll" for example, so a slow callback is logged along with the
+command it was running for.
+"""
+
+
+MAX_SECONDS = 120
+
+# How many functions the report lists
+TOP = 60
+
+TASK_NAME = re.compile(r"name='cmd:([^']+)'")
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is started while another is running"""
+    pass
+
+
+# Reloading the module doesn't forget a profile that's running
+if "_running" not in globals():
+    _running = False
+
+
+async def profile(seconds):
+    """
+    Profiles the event loop for a while.
+
+    Parameters:
+        seconds: float
+
+    Returns:
+        str, the functions that took the most cumulative time
+
+    Raises:
+        ProfilerBusyError
+    """
+
+    global _running
+
+    if _running:
+        raise ProfilerBusyError
+
+    seconds = min(max(seconds, 0), MAX_SECONDS)
+    profiler = cProfile.Profile()
+
+    _running = True
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        # Also when cancelled, or the profiler would stay on for good
+        profiler.disable()
+        _running = False
+
+    report = io.StringIO()
+    report.write(f"Event loop profile over {seconds:g} seconds\n\n")
+    stats = pstats.Stats(profiler, stream=report)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(TOP)
+
+    return report.getvalue()
+
+
+def tag_task(ctx):
+    """
+    Names the task running a command after the command.
+    """
+
+    task = asyncio.current_task()
+    if task is not None:
+        task.set_name(f"cmd:{ctx.command.qualified_name}")
+
+
+class SlowCallbackFilter(logging.Filter):
+    """
+    Adds the command a slow callback was running for to asyncio's warning.
+    """
+
+    def filter(self, record):
+        message = record.getMessage()
+        if not message.startswith("Executing"):
+            return True
+
+        command = TASK_NAME.search(message)
+        command = command.group(1) if command else "no command"
+
+        record.msg = f"Slow callback ({command}): {message}"
+        record.args = None
+        return True
+
+
+def report_slow_callbacks(loop, threshold):
+    """
+    Logs every callback on the loop taking longer than threshold seconds.
+
+    Parameters:
+        loop: asyncio.AbstractEventLoop
+        threshold: float
+    """
+
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold
+
+    logger = logging.getLogger("asyncio")
+    if not any(isinstance(existing, SlowCallbackFilter)
+               for existing in logger.filters):
+        logger.addFilter(SlowCallbackFilter())
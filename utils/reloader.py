@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import ast
+import asyncio
+import importlib
+import importlib.util
+import os
+import sys
+import time
+
+from discord.ext import commands
+
+
+"""
+Reloads a single cog, along with the utils modules it depends on, without
+restarting the bot.
+
+A cog's dependencies are the utils modules its source imports, directly or
+through other utils modules. Imports are read from the source of each module,
+so the order doesn't depend on what a module happens to keep in its namespace.
+Every module is reloaded after the modules it imports, and then the cog itself
+is reloaded with reload_extension. The gateway connection and everything kept
+on the bot stay as they are.
+
+A module doing "from module import name" keeps the old object after module is
+reloaded. Every utils module importing names out of a reloaded module is
+reloaded along with it, and so is every other loaded cog doing so. A reload is
+refused if any other module of the bot, such as bot.py, imports names out of a
+module it would reload, since that module can only pick up the change after a
+restart.
+
+Reloading runs a module again inside its existing namespace, so a module
+holding state it must not lose only sets it up when it isn't already there.
+
+The watcher polls the files of every loaded cog and its dependencies, and
+reloads the cogs whose files changed.
+"""
+
+
+# Only modules in these packages are ever reloaded
+PACKAGES = ("utils.",)
+
+# Where the bot's own modules live, anything else is never looked at
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# How often the watcher checks for changed files, in seconds
+WATCH_INTERVAL = 1
+
+
+class ReloadRefusedError(Exception):
+    """Raised when a module outside utils and cogs would keep stale names"""
+    pass
+
+
+def imports(module):
+    """
+    Reads the loaded modules a module imports from its source.
+
+    Parameters:
+        module: ModuleType
+
+    Returns:
+        {name: bool}, True where names are imported out of the module rather
+        than the module itself
+    """
+
+    path = getattr(module, "__file__", None)
+    if not path or not path.endswith(".py"):
+        return {}
+
+    try:
+        with open(path, encoding="utf-8") as source:
+            tree = ast.parse(source.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        return {}
+
+    found = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                found.setdefault(alias.name, False)
+
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                try:
+                    base = importlib.util.resolve_name(
+                        "." * node.level + base, module.__package__)
+                except (ImportError, ValueError):
+                    continue
+
+            for alias in node.names:
+                submodule = f"{base}.{alias.name}"
+                if submodule in sys.modules:
+                    found.setdefault(submodule, False)
+                else:
+                    found[base] = True
+
+    return {name: by_name for name, by_name in found.items()
+            if name in sys.modules}
+
+
+def import_graph():
+    """
+    Reads what every loaded module of the bot imports.
+
+    Returns:
+        {name: {name: bool}}, see imports
+    """
+
+    graph = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(ROOT + os.sep):
+            graph[name] = imports(module)
+
+    return graph
+
+
+def ordered(names, graph):
+    """
+    Orders modules so every module comes after the modules it imports.
+
+    Parameters:
+        names: {str, str..., str}
+        graph: the return value of import_graph
+
+    Returns:
+        [str, str..., str]
+    """
+
+    order = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+
+        for dependency in sorted(graph.get(name, {})):
+            if dependency in names:
+                visit(dependency)
+        order.append(name)
+
+    for name in sorted(names):
+        visit(name)
+
+    return order
+
+
+def dependencies(module, graph=None):
+    """
+    Finds the utils modules a module imports, directly or not.
+
+    Parameters:
+        module: ModuleType
+        graph: the return value of import_graph, read again if None
+
+    Returns:
+        [ModuleType, ModuleType..., ModuleType] with every module listed after
+        the modules it imports
+    """
+
+    if graph is None:
+        graph = import_graph()
+
+    found = set()
+    pending = [module.__name__]
+    while pending:
+        for name in graph.get(pending.pop(), {}):
+            if name.startswith(PACKAGES) and name not in found:
+                found.add(name)
+                pending.append(name)
+
+    return [sys.modules[name] for name in ordered(found, graph)]
+
+
+def importers(names, graph):
+    """
+    Finds the modules importing names out of any of the given modules,
+    directly or out of a module that does so itself.
+
+    Parameters:
+        names: {str, str..., str}
+        graph: the return value of import_graph
+
+    Returns:
+        ({str, str..., str}, {str, str..., str}): the utils modules among
+        them, and every other module
+    """
+
+    reloaded = set(names)
+    others = set()
+
+    changed = True
+    while changed:
+        changed = False
+        for name, imported in graph.items():
+            if name in reloaded or name in others:
+                continue
+            if not any(by_name and dependency in reloaded
+                       for dependency, by_name in imported.items()):
+                continue
+
+            if name.startswith(PACKAGES):
+                # Rerunning it rebinds its names, which its own importers
+                # then have to pick up in turn
+                reloaded.add(name)
+                changed = True
+            else:
+                others.add(name)
+
+    return reloaded - set(names), others
+
+
+def extension_name(name):
+    """
+    Turns a cog name like "rolling" into its extension name, "cogs.rolling".
+    """
+
+    return name if name.startswith("cogs.") else f"cogs.{name}"
+
+
+async def reload(bot, name):
+    """
+    Reloads a cog and the utils modules it depends on, along with whatever
+    imports names out of those modules.
+
+    Parameters:
+        bot: commands.Bot
+        name: str
+
+    Returns:
+        (float, [str, str..., str], [str, str..., str]): the seconds the
+        reload took, the utils modules reloaded and the other cogs reloaded
+
+    Raises:
+        commands.ExtensionError, ReloadRefusedError, or whatever importing a
+        module raised
+    """
+
+    extension = extension_name(name)
+    if extension not in bot.extensions:
+        raise commands.ExtensionNotLoaded(extension)
+
+    start = time.perf_counter()
+
+    graph = import_graph()
+    names = {module.__name__ for module in
+             dependencies(bot.extensions[extension], graph)}
+
+    extra, others = importers(names, graph)
+    names |= extra
+    others.discard(extension)
+
+    extensions = sorted(other for other in others if other in bot.extensions)
+    stale = sorted(other for other in others
+                   if other not in bot.extensions
+                   and not other.startswith("cogs."))
+    if stale:
+        raise ReloadRefusedError(f"{', '.join(stale)} would keep names from "
+                                 "the old modules. Restart the bot instead.")
+
+    modules = [sys.modules[module] for module in ordered(names, graph)]
+    for module in modules:
+        importlib.reload(module)
+
+    bot.reload_extension(extension)
+    for other in extensions:
+        bot.reload_extension(other)
+
+    return (time.perf_counter() - start,
+            [module.__name__ for module in modules], extensions)
+
+
+def watched_files(bot):
+    """
+    Maps every file a loaded cog depends on to the cogs depending on it.
+
+    Returns:
+        {path: {extension, extension..., extension}}
+    """
+
+    graph = import_graph()
+
+    files = {}
+    for extension, module in bot.extensions.items():
+        for watched in [module] + dependencies(module, graph):
+            path = getattr(watched, "__file__", None)
+            if path:
+                files.setdefault(path, set()).add(extension)
+
+    return files
+
+
+def modified_times(files):
+    times = {}
+    for path in files:
+        try:
+            times[path] = os.stat(path).st_mtime
+        except OSError:
+            pass
+    return times
+
+
+async def watch(bot, interval=WATCH_INTERVAL):
+    """
+    Reloads cogs as their files, or the files of the utils modules they use,
+    change. Runs until cancelled.
+
+    Parameters:
+        bot: commands.Bot
+        interval: float
+    """
+
+    files = watched_files(bot)
+    times = modified_times(files)
+
+    while True:
+        await asyncio.sleep(interval)
+
+        current = modified_times(files)
+        changed = [path for path, mtime in current.items()
+                   if times.get(path) != mtime]
+        if not changed:
+            continue
+
+        extensions = set()
+        for path in changed:
+            extensions |= files[path]
+
+        for extension in sorted(extensions):
+            try:
+                elapsed, modules, others = await reload(bot, extension)
+            except Exception as error:
+                bot.logger.warning(f"Reloading {extension} failed: "
+                                   f"{type(error).__name__}: {error}")
+                continue
+
+            also = f" along with {', '.join(others)}" if others else ""
+            bot.logger.warning(f"Reloaded {extension} and {len(modules)} "
+                               f"utils modules{also} in "
+                               f"{elapsed * 1000:.0f}ms")
+
+        files = watched_files(bot)
+        times = modified_times(files)
@@ -7,9 +7,99 @@ Please see the license for any restrictions or rights granted to you by the
 License.
 """
 
-import random
+from array import array
+from functools import lru_cache
+from utils.rolling import rng
 
 
-async def roll(dice_pool=1, sides=6):
-    # Weirdly, randrange seems to be way faster than randint
-    return [random.randrange(sides) + 1 for _ in range(0, dice_pool)]
+def roll(dice_pool=1, sides=6, stream=None):
+    if sides > 256:
+        return _large_faces(dice_pool, sides, stream)
+
+    return list(_faces(dice_pool, sides, stream))
+
+
+def roll_counts(dice_pool=1, sides=6, stream=None):
+    """
+    Rolls a pool of dice and returns how many times each face came up
+    rather than the individual rolls.
+
+    Parameters:
+        dice_pool: int
+        sides: int
+        stream: rng.Stream or None
+
+    Returns:
+        counts: [int, int..., int] where counts[0] is the amount of ones
+    """
+
+    return _face_counts(dice_pool, sides, stream)
+
+
+def _faces(dice_pool, sides=6, stream=None):
+    """
+    Rolls dice_pool dice as a bytes object, one byte per die holding the
+    face value.
+
+    Random bytes are drawn from the stream in one block and mapped onto faces
+    with a translation table. Bytes that would bias the result are dropped
+    and redrawn, so every face stays equally likely.
+    """
+
+    if stream is None:
+        stream = rng.spawn()
+
+    table, rejects = _face_table(sides)
+    faces = b""
+
+    while len(faces) < dice_pool:
+        needed = dice_pool - len(faces)
+        # Draw slightly more than needed so a redraw is rarely required
+        block = stream.randbytes(needed + (needed >> 4) + 8)
+        faces += block.translate(table, rejects)
+
+    return faces[:dice_pool]
+
+
+def _face_counts(dice_pool, sides=6, stream=None):
+    """
+    Rolls dice_pool dice and counts each face without building a list of
+    the individual rolls.
+    """
+
+    faces = _faces(dice_pool, sides, stream)
+    return [faces.count(face) for face in range(1, sides + 1)]
+
+
+def _large_faces(dice_pool, sides, stream=None):
+    """
+    Rolls dice with more sides than fit in a byte, using a 64 bit word from
+    the stream for each die.
+    """
+
+    if stream is None:
+        stream = rng.spawn()
+
+    limit = (1 << 64) - ((1 << 64) % sides)
+    faces = []
+
+    while len(faces) < dice_pool:
+        words = array('Q')
+        words.frombytes(stream.randbytes(8 * (dice_pool - len(faces))))
+        faces.extend(word % sides + 1 for word in words if word < limit)
+
+    return faces
+
+
+@lru_cache(maxsize=None)
+def _face_table(sides):
+    """
+    Builds the translation table mapping a random byte onto a die face, along
+    with the bytes that must be rejected to keep the faces unbiased.
+    """
+
+    cutoff = 256 - (256 % sides)
+    table = bytes((byte % sides) + 1 if byte < cutoff else 0
+                  for byte in range(256))
+    rejects = bytes(range(cutoff, 256))
+    return table, rejects
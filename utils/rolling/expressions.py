@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import operator
+import re
+from functools import lru_cache
+
+from utils.rolling import base, render, rng
+
+
+"""
+Dice expressions, such as "12d6!>=5 + 3", "(4+2)d6 kh3" or "2x(8d6>=4)".
+
+    expression := [INT "x"] sum
+    sum        := product (("+" | "-") product)*
+    product    := unary ("*" unary)*
+    unary      := "-" unary | atom
+    atom       := dice | INT | "(" sum ")"
+    dice       := [INT | "(" sum ")"] "d" INT modifier*
+    modifier   := "!" | ("kh" | "kl" | "k") INT | comparison INT
+    comparison := ">=" | ">" | "<=" | "<" | "="
+
+A dice term is worth the sum of its dice, or the amount of dice meeting the
+comparison if it has one. "!" rerolls dice showing their highest face and adds
+the reroll to the die, the same way sixes explode in SR3E. "kh" and "kl" keep
+the highest or lowest dice.
+
+Expressions are compiled once into a plan of nested functions. Plans are
+cached by their normalized text, so a macro used over and over is only ever
+parsed once. Every plan rolls through the batched roller in utils.rolling.base
+and is limited in how many dice it may roll, so no expression can tie up the
+bot.
+"""
+
+
+MAX_LENGTH = 200
+MAX_NESTING = 16
+
+# Limits on a single evaluation, counting every repeat and explosion
+MAX_DICE = 10_000
+MAX_SIDES = 1_000
+MAX_REPEAT = 20
+MAX_EXPLOSIONS = 20
+
+TOKEN = re.compile(r"(\d+)|(kh|kl|k|d|x|>=|<=|[-+*()!<>=])")
+DICE = re.compile(r"(^|[\d)])d\d")
+
+COMPARISONS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "=": operator.eq,
+}
+
+
+class ExpressionError(Exception):
+    """Raised when an expression is malformed or exceeds a limit"""
+    pass
+
+
+class Plan():
+    """
+    A compiled dice expression.
+    """
+
+    __slots__ = ("expression", "repeat", "evaluate_once", "dice")
+
+    def __init__(self, expression, repeat, evaluate_once, dice=0):
+        self.expression = expression
+        self.repeat = repeat
+        self.evaluate_once = evaluate_once
+
+        # The most dice the plan rolls over all its repeats, not counting
+        # explosions
+        self.dice = dice
+
+    def evaluate(self, stream=None):
+        """
+        Rolls the expression.
+
+        Parameters:
+            stream: rng.Stream or None
+
+        Returns:
+            [[total, log], [total, log]..., [total, log]] with one entry per
+            repeat. Each log holds a [label, dice, value] entry for each dice
+            term that was rolled.
+        """
+
+        state = _State(stream or rng.spawn())
+        results = []
+
+        for _ in range(self.repeat):
+            state.log = []
+            total = self.evaluate_once(state)
+            results.append([total, state.log])
+
+        return results
+
+
+class _State():
+    """
+    Everything one evaluation of a plan shares between its terms.
+    """
+
+    __slots__ = ("stream", "dice", "log")
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.dice = 0
+        self.log = []
+
+    def roll(self, dice, sides):
+        self.dice += dice
+        if self.dice > MAX_DICE:
+            raise ExpressionError(f"Expressions may roll at most {MAX_DICE} "
+                                  "dice.")
+
+        if sides > 256:
+            return base._large_faces(dice, sides, self.stream)
+        return list(base._faces(dice, sides, self.stream))
+
+
+def looks_like_expression(args):
+    """
+    Checks whether the arguments of a roll are a dice expression rather than
+    the usual dice and threshold.
+
+    Parameters:
+        args: (str, str..., str)
+
+    Returns:
+        bool
+    """
+
+    expression, _ = split_note(args)
+    return bool(DICE.search(normalize(expression)))
+
+
+def split_note(args):
+    """
+    Splits the -n/--note of a roll off the dice expression before it.
+
+    Parameters:
+        args: (str, str..., str)
+
+    Returns:
+        (expression: str, note: str or None)
+    """
+
+    for position, arg in enumerate(args):
+        if arg in ("-n", "--note"):
+            return " ".join(args[:position]), " ".join(args[position + 1:])
+
+    return " ".join(args), None
+
+
+def normalize(expression):
+    """
+    Returns the expression in the form plans are cached under.
+    """
+
+    return "".join(expression.lower().split())
+
+
+def compile_expression(expression):
+    """
+    Gets the plan for an expression, compiling it if it isn't cached.
+
+    Parameters:
+        expression: str
+
+    Returns:
+        Plan
+
+    Raises:
+        ExpressionError
+    """
+
+    return _compile(normalize(expression))
+
+
+@lru_cache(maxsize=1024)
+def _compile(expression):
+    if len(expression) > MAX_LENGTH:
+        raise ExpressionError(f"Expressions may be at most {MAX_LENGTH} "
+                              "characters long.")
+
+    parser = _Parser(expression)
+    repeat, tree = parser.parse()
+    dice = min(_dice_in(tree), MAX_DICE) * repeat
+    return Plan(expression, repeat, _plan(tree), dice)
+
+
+def _dice_in(tree):
+    """
+    Counts the dice a tree from the parser rolls. A count that is rolled
+    itself could be anything up to the limit.
+    """
+
+    kind = tree[0]
+
+    if kind == "number":
+        return 0
+
+    if kind == "op":
+        return _dice_in(tree[2]) + _dice_in(tree[3])
+
+    count = tree[1]
+    rolled = _dice_in(count)
+    if not rolled:
+        # Without dice in it the count works out the same every time
+        return max(_plan(count)(None), 0)
+
+    return rolled + MAX_DICE
+
+
+class _Parser():
+    """
+    A recursive descent parser building a tree of tuples.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = []
+        self.position = 0
+        self.nesting = 0
+
+        end = 0
+        for match in TOKEN.finditer(expression):
+            if match.start() != end:
+                break
+            self.tokens.append((match.group(), match.start(), match.end()))
+            end = match.end()
+
+        if end != len(expression):
+            raise ExpressionError(f"I don't understand "
+                                  f"`{expression[end:end + 10]}`.")
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset][0]
+        return None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected and token != expected):
+            wanted = f"`{expected}`" if expected else "more"
+            raise ExpressionError(f"Expected {wanted} in the expression.")
+        self.position += 1
+        return token
+
+    def number(self):
+        token = self.take()
+        if not token.isdecimal():
+            raise ExpressionError(f"Expected a number instead of `{token}`.")
+        return int(token)
+
+    def parse(self):
+        repeat = 1
+
+        if self.peek(1) == "x" and (self.peek() or "").isdecimal():
+            repeat = self.number()
+            self.take("x")
+            if not 1 <= repeat <= MAX_REPEAT:
+                raise ExpressionError(f"Expressions may repeat at most "
+                                      f"{MAX_REPEAT} times.")
+
+        tree = self.sum()
+        if self.peek() is not None:
+            raise ExpressionError(f"Unexpected `{self.peek()}` in the "
+                                  "expression.")
+        return repeat, tree
+
+    def sum(self):
+        tree = self.product()
+        while self.peek() in ("+", "-"):
+            op = operator.add if self.take() == "+" else operator.sub
+            tree = ("op", op, tree, self.product())
+        return tree
+
+    def product(self):
+        tree = self.unary()
+        while self.peek() == "*":
+            self.take()
+            tree = ("op", operator.mul, tree, self.unary())
+        return tree
+
+    def unary(self):
+        if self.peek() == "-":
+            self.take()
+            return ("op", operator.sub, ("number", 0), self.unary())
+        return self.atom()
+
+    def atom(self):
+        start = self.tokens[self.position][1] if self.peek() else None
+        token = self.peek()
+
+        if token == "(":
+            count = self.group()
+        elif token is not None and token.isdecimal():
+            count = ("number", self.number())
+        elif token == "d":
+            count = ("number", 1)
+        else:
+            raise ExpressionError("Expected a number, dice or `(`.")
+
+        if self.peek() != "d":
+            return count
+
+        return self.dice(count, start)
+
+    def group(self):
+        self.nesting += 1
+        if self.nesting > MAX_NESTING:
+            raise ExpressionError("The expression is nested too deeply.")
+
+        self.take("(")
+        tree = self.sum()
+        self.take(")")
+
+        self.nesting -= 1
+        return tree
+
+    def dice(self, count, start):
+        self.take("d")
+        sides = self.number()
+        explode = False
+        keep = None
+        compare = None
+
+        while self.peek() in ("!", "kh", "kl", "k") or \
+                self.peek() in COMPARISONS:
+            token = self.take()
+            if token == "!":
+                explode = True
+            elif token in COMPARISONS:
+                compare = (COMPARISONS[token], self.number())
+            else:
+                keep = (token != "kl", self.number())
+
+        if not 1 <= sides <= MAX_SIDES:
+            raise ExpressionError(f"Dice may have 1 to {MAX_SIDES} sides.")
+        if explode and sides == 1:
+            raise ExpressionError("One sided dice can't explode.")
+        if count[0] == "number" and count[1] > MAX_DICE:
+            raise ExpressionError(f"Expressions may roll at most {MAX_DICE} "
+                                  "dice.")
+
+        end = self.tokens[self.position - 1][2]
+        label = self.expression[start:end]
+        return ("dice", count, sides, explode, compare, keep, label)
+
+
+def _plan(tree):
+    """
+    Turns a tree from the parser into a function that evaluates it.
+    """
+
+    kind = tree[0]
+
+    if kind == "number":
+        value = tree[1]
+        return lambda state: value
+
+    if kind == "op":
+        _, op, left, right = tree
+        left = _plan(left)
+        right = _plan(right)
+        return lambda state: op(left(state), right(state))
+
+    _, count, sides, explode, compare, keep, label = tree
+    count = _plan(count)
+
+    def roll_dice(state):
+        dice = max(count(state), 0)
+        totals = state.roll(dice, sides)
+
+        if explode:
+            exploding = [die for die, total in enumerate(totals)
+                         if total == sides]
+            rounds = 0
+            while exploding and rounds < MAX_EXPLOSIONS:
+                rerolls = state.roll(len(exploding), sides)
+                for die, reroll in zip(exploding, rerolls):
+                    totals[die] += reroll
+                exploding = [die for die, reroll in zip(exploding, rerolls)
+                             if reroll == sides]
+                rounds += 1
+
+        totals.sort()
+        kept = totals
+        if keep:
+            highest, amount = keep
+            kept = totals[-amount:] if highest else totals[:amount]
+            if not amount:
+                kept = []
+
+        if compare:
+            test, target = compare
+            value = sum(1 for total in kept if test(total, target))
+        else:
+            value = sum(kept)
+
+        state.log.append([label, kept, value])
+        return value
+
+    return roll_dice
+
+
+async def format_results(plan, results):
+    """
+    Formats the results of a plan in an easy to read fashion.
+
+    Parameters:
+        plan: Plan
+        results: the return value of Plan.evaluate
+
+    Returns:
+        message: str
+    """
+
+    totals = ", ".join(str(total) for total, _ in results)
+    descriptor = "Results" if len(results) > 1 else "Result"
+    fields = {"descriptor": descriptor, "totals": totals,
+              "expression": plan.expression}
+
+    # Share the room left in the message evenly between the dice terms
+    _, _, budget = render.EXPRESSION.fill(render.EMBED_LIMIT, fields)
+    terms = sum(len(log) for _, log in results) or 1
+    fixed = sum(len(label) + len(str(value)) + 8
+                for _, log in results for label, _, value in log)
+    headers = 20 * len(results) if len(results) > 1 else 0
+    per_term = (budget - fixed - headers) // terms
+
+    lines = []
+    for repeat, (total, log) in enumerate(results, start=1):
+        if len(results) > 1:
+            lines.append(f"# Roll {repeat}: {total}")
+        for label, dice, value in log:
+            dice = render.rolls_text(dice, per_term)
+            lines.append(f"> {label}: {dice} = {value}")
+
+    return render.EXPRESSION.render_lines(lines, **fields)
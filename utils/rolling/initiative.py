@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from bisect import bisect_left
+from utils.rolling import render, sr3e
+
+
+"""
+Initiative tracking for SR3E combat, found on page 100 of the SR3E core
+rulebook.
+
+Everyone with an initiative above 0 acts in order from highest to lowest.
+After each initiative pass every score drops by 10, and once nobody is left
+above 0 the combat turn ends and initiative is rolled again.
+
+Combatants are kept in a list sorted by their rolled score. Since every
+score drops by the same amount each pass, the order never changes during a
+combat turn: the pass number is stored once instead of being subtracted from
+everyone, and the combatants acting in a pass are always a prefix of the
+list.
+"""
+
+
+class CombatantNotFoundError(Exception):
+    """Raised when a combatant is not part of the combat"""
+    pass
+
+
+class InvalidInitiativeError(Exception):
+    """Raised when initiative dice or a delay aren't a positive number"""
+    pass
+
+
+class Combatant():
+    """
+    Somebody taking part in a combat.
+    """
+
+    def __init__(self, name, dice, modifier, score=0, seq=0):
+        self.name = name
+        self.dice = dice
+        self.modifier = modifier
+        self.score = score
+
+        # Breaks ties so whoever joined first acts first
+        self.seq = seq
+
+    @property
+    def key(self):
+        return (-self.score, self.seq, self.name)
+
+
+class InitiativeTracker():
+    """
+    Tracks the initiative order of a single channel.
+    """
+
+    def __init__(self):
+        self.combatants = {}
+        self.order = []
+        self.turn = 1
+        self.passes = 0
+        self.joined = 0
+
+        # Nobody acts until the combat is advanced for the first time
+        self.position = -1
+
+    def join(self, name, dice, modifier):
+        """
+        Rolls initiative for a new combatant and adds them to the order.
+
+        Parameters:
+            name: str
+            dice: int
+            modifier: int
+
+        Returns:
+            Combatant
+
+        Raises:
+            InvalidInitiativeError
+        """
+
+        if not _is_count(dice) or not isinstance(modifier, int):
+            raise InvalidInitiativeError
+
+        if name in self.combatants:
+            self.leave(name)
+
+        _, score = sr3e.roll_initiative(dice, modifier)
+        combatant = Combatant(name, dice, modifier, score, self.joined)
+        self.joined += 1
+
+        self.combatants[name] = combatant
+
+        # Keep whoever is currently acting in place
+        if self.add(combatant) <= self.position:
+            self.position += 1
+
+        return combatant
+
+    def leave(self, name):
+        """
+        Removes a combatant from the order.
+        """
+
+        combatant = self.find(name)
+        index = self.remove(combatant)
+        del self.combatants[name]
+
+        # Keep whoever is currently acting in place
+        if index < self.position:
+            self.position -= 1
+
+    def delay(self, name, amount):
+        """
+        Delays a combatant's action by lowering their initiative score.
+
+        Raises:
+            CombatantNotFoundError
+            InvalidInitiativeError
+        """
+
+        if not _is_count(amount):
+            raise InvalidInitiativeError
+
+        combatant = self.find(name)
+        acting = combatant is self.current()
+
+        index = self.remove(combatant)
+        if index < self.position:
+            self.position -= 1
+
+        combatant.score -= amount
+        index = self.add(combatant)
+
+        if acting and index == self.position:
+            # Still ahead of everyone who hasn't acted, so it stays their turn
+            pass
+        elif index <= self.position:
+            # Keep whoever is currently acting in place
+            self.position += 1
+
+    def advance(self):
+        """
+        Moves to the next combatant. Starts a new initiative pass after the
+        last combatant of a pass acts, and a new combat turn once nobody is
+        able to act.
+
+        Returns:
+            The combatant whose action it is, or None if nobody is in combat.
+        """
+
+        if not self.order:
+            return None
+
+        self.position += 1
+
+        if self.position >= self.acting():
+            self.passes += 1
+            self.position = 0
+
+            if not self.acting():
+                self.new_turn()
+
+        return self.current()
+
+    def new_turn(self):
+        """
+        Starts a new combat turn, rolling initiative for everybody again.
+        """
+
+        self.turn += 1
+        self.passes = 0
+        self.position = 0
+
+        for combatant in self.combatants.values():
+            _, combatant.score = sr3e.roll_initiative(combatant.dice,
+                                                      combatant.modifier)
+
+        # Every score changed, so this is the only full sort in a turn.
+        self.order = sorted(combatant.key
+                            for combatant in self.combatants.values())
+
+    def current(self):
+        """
+        The combatant who is acting right now, or None.
+        """
+
+        if 0 <= self.position < self.acting():
+            return self.combatants[self.order[self.position][2]]
+        return None
+
+    def acting(self):
+        """
+        How many combatants act in the current initiative pass.
+        """
+
+        return bisect_left(self.order, (-10 * self.passes,))
+
+    def score(self, combatant):
+        """
+        The combatant's initiative score in the current pass.
+        """
+
+        return combatant.score - 10 * self.passes
+
+    def find(self, name):
+        try:
+            return self.combatants[name]
+        except KeyError:
+            raise CombatantNotFoundError
+
+    def add(self, combatant):
+        index = bisect_left(self.order, combatant.key)
+        self.order.insert(index, combatant.key)
+        return index
+
+    def remove(self, combatant):
+        index = bisect_left(self.order, combatant.key)
+        del self.order[index]
+        return index
+
+    def format_order(self):
+        """
+        Formats the initiative order in an easy to read fashion.
+        """
+
+        lines = []
+        for index, key in enumerate(self.order):
+            combatant = self.combatants[key[2]]
+            score = self.score(combatant)
+            marker = ">" if index == self.position else " "
+            if score <= 0:
+                marker = "-"
+            lines.append(f"{marker} {score:>4}  {combatant.name}")
+
+        return render.INITIATIVE_ORDER.render_lines(
+            lines, turn=self.turn, initiative_pass=self.passes + 1)
+
+    def to_dict(self):
+        """
+        Returns the tracker as a dict that can be stored as JSON.
+        """
+
+        return {
+            "turn": self.turn,
+            "passes": self.passes,
+            "position": self.position,
+            "joined": self.joined,
+            "combatants": [[c.name, c.dice, c.modifier, c.score, c.seq]
+                           for c in self.combatants.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        Rebuilds a tracker from the output of to_dict.
+        """
+
+        tracker = cls()
+        tracker.turn = state["turn"]
+        tracker.passes = state["passes"]
+        tracker.position = state["position"]
+        tracker.joined = state["joined"]
+
+        for combatant in state["combatants"]:
+            combatant = Combatant(*combatant)
+            tracker.combatants[combatant.name] = combatant
+
+        tracker.order = sorted(combatant.key
+                               for combatant in tracker.combatants.values())
+        return tracker
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) \
+        and value >= 0
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from array import array
+from fractions import Fraction
+
+
+"""
+Exact odds for SR3E tests.
+
+Every die is an independent trial with the same chance to score a hit, so
+the amount of hits follows a binomial distribution. The distributions are
+kept in a table built by convolving one die at a time: row n of a table is
+the distribution for n dice. Rows for common pools are built on import, and
+larger pools extend the table the first time they are asked for.
+"""
+
+
+# Pools up to this size are calculated when the module is loaded.
+PRECOMPUTED_DICE = 40
+PRECOMPUTED_THRESHOLDS = range(2, 13)
+
+# Largest pool the table will grow to.
+MAX_DICE = 500
+
+ONE = Fraction(1, 6)
+
+# How many rows of hits an odds table shows at most
+ROWS = 21
+
+# Chances below this aren't worth a row of their own
+NEGLIGIBLE = 0.0005
+
+
+class OddsTooLargeError(Exception):
+    """Raised when the odds for a pool larger than MAX_DICE are requested"""
+    pass
+
+
+class HitTable():
+    """
+    Memoized hit distributions for a single per-die chance of success.
+    """
+
+    def __init__(self, chance):
+        self.chance = float(chance)
+        self.rows = [array('d', [1.0])]
+
+    def row(self, dice):
+        """
+        Returns the distribution of hits for the amount of dice, where
+        row[k] is the chance of exactly k hits.
+        """
+
+        if dice > MAX_DICE:
+            raise OddsTooLargeError
+
+        while len(self.rows) <= dice:
+            self.rows.append(self.extend(self.rows[-1]))
+
+        return self.rows[dice]
+
+    def extend(self, previous):
+        """
+        Convolves a distribution with a single die.
+        """
+
+        hit = self.chance
+        miss = 1.0 - hit
+
+        row = array('d', [0.0]) * (len(previous) + 1)
+        for hits, chance in enumerate(previous):
+            row[hits] += chance * miss
+            row[hits + 1] += chance * hit
+
+        return row
+
+
+TABLES = {}
+
+
+def die_chance(threshold):
+    """
+    Returns the chance a single die meets or exceeds the threshold.
+
+    Sixes are rerolled and added, so a threshold above 6 needs a 6 and then
+    the remaining threshold on the reroll.
+    """
+
+    chance = Fraction(1)
+
+    while threshold > 6:
+        chance *= ONE
+        threshold -= 6
+
+    if threshold > 1:
+        chance *= Fraction(7 - threshold, 6)
+
+    return chance
+
+
+def table(chance):
+    """
+    Gets the table for a per-die chance, creating it if needed.
+    """
+
+    if chance not in TABLES:
+        TABLES[chance] = HitTable(chance)
+
+    return TABLES[chance]
+
+
+def precompute():
+    """
+    Builds the rows for common pools and thresholds.
+    """
+
+    for threshold in PRECOMPUTED_THRESHOLDS:
+        table(die_chance(threshold)).row(PRECOMPUTED_DICE)
+
+
+def hit_distribution(dice, threshold):
+    """
+    Gets the chance of rolling each amount of hits.
+
+    Parameters:
+        dice: int
+        threshold: int
+
+    Returns:
+        distribution: array of floats, where distribution[k] is the chance
+                      of exactly k hits
+    """
+
+    return table(die_chance(threshold)).row(dice)
+
+
+def glitch_chance(dice):
+    """
+    Gets the chance of a glitch, using the same definition as sr3e.glitch:
+    at least half the dice show a one, with an odd pool counted as one more
+    die.
+
+    Parameters:
+        dice: int
+
+    Returns:
+        chance: float
+    """
+
+    ones = table(ONE).row(dice)
+    needed = dice + (dice % 2)
+    needed = needed // 2
+
+    return sum(ones[needed:])
+
+
+def critical_glitch_chance(dice):
+    """
+    Gets the chance of a critical glitch, using the same definition as
+    sr3e.critical_glitch: every die shows a one.
+
+    Parameters:
+        dice: int
+
+    Returns:
+        chance: float
+    """
+
+    return table(ONE).row(dice)[dice]
+
+
+async def format_odds(dice, threshold, glitches=False):
+    """
+    Formats the odds of a test in an easy to read fashion.
+
+    Parameters:
+        dice: int
+        threshold: int
+        glitches: bool
+            Whether to include the optional non-critical glitch rule
+
+    Returns:
+        message: str
+    """
+
+    distribution = hit_distribution(dice, threshold)
+    expected = dice * float(die_chance(threshold))
+
+    # Skip the results too unlikely to matter at the start of large pools,
+    # and keep the rows shown centred on the expected hits
+    first = 0
+    at_least = 1.0
+    while at_least - distribution[first] > 1 - NEGLIGIBLE:
+        at_least -= distribution[first]
+        first += 1
+
+    start = max(first, round(expected) - ROWS // 2)
+    at_least -= sum(distribution[first:start])
+
+    lines = []
+    for hits in range(start, min(start + ROWS, len(distribution))):
+        # Stop once the remaining results are too unlikely to matter
+        if at_least < NEGLIGIBLE:
+            break
+        chance = distribution[hits]
+        lines.append(f"{hits:>4}  {chance:>8.1%}  {at_least:>8.1%}")
+        at_least -= chance
+
+    lines = "\n".join(lines)
+
+    message = f"""
+        ```md
+        < Odds: {dice} dice, Target Number {threshold} >
+        ===================
+
+        > Expected hits: {expected:.2f}
+
+        Hits   Exactly  At least
+        {{lines}}
+        ===================
+
+        """
+
+    message = message.replace("        ", "")
+    message = message.replace("{lines}", lines)
+
+    if glitches:
+        message += f"> Glitch: {glitch_chance(dice):.2%}\n"
+
+    crit = critical_glitch_chance(dice)
+    message += f"> Critical Glitch: {crit:.2%}\n"
+    message += "```"
+
+    return message
+
+
+precompute()
@@ -8,6 +8,9 @@ License.
 """
 
 import argparse
+import re
+from collections import namedtuple
+from functools import lru_cache
 
 
 class InvalidArgumentsError(Exception):
@@ -53,3 +56,137 @@ class Sr3RollParser(BaseRollParser):
                           metavar="score")
         self.add_argument("-o", "--open", action="store_true",
                           help="Gets open ended test threshold")
+        self.add_argument("repeat", nargs="?", metavar="xN",
+                          help="Repeats the test N times")
+
+    def parse_args(self, args=None, namespace=None):
+        """
+        Pulls the xN repeat count out before parsing the rest, since
+        argparse can't tell it apart from the threshold.
+        """
+
+        args = list(args or [])
+        repeat = 1
+
+        for position, arg in enumerate(args):
+            if arg in ("-n", "--note"):
+                break
+            if re.fullmatch(r"x\d+", arg):
+                repeat = int(args.pop(position)[1:])
+                break
+
+        # A test can't be repeated zero times
+        if repeat < 1:
+            raise InvalidArgumentsError
+
+        parsed = super().parse_args(args, namespace)
+        if parsed.repeat is not None:
+            raise InvalidArgumentsError
+        parsed.repeat = repeat
+        return parsed
+
+
+"""
+Building an argparse parser is by far the most expensive part of a roll, so
+a single parser is built when the module is loaded. The common forms of a
+roll, like "12", "12 5", "-i 9 3" or "-o 8", are read by a small tokenizer
+instead, and argparse is only used for everything else. Parsed results are
+immutable and cached by their arguments.
+"""
+
+
+ParsedRoll = namedtuple("ParsedRoll", ["help", "dice", "note", "threshold",
+                                       "m", "i", "open", "repeat"])
+
+SR3_PARSER = Sr3RollParser()
+SR3_HELP = SR3_PARSER.format_help()
+
+REPEAT = re.compile(r"x(\d+)")
+
+
+@lru_cache(maxsize=4096)
+def parse_sr3(args):
+    """
+    Parses the arguments of an SR3E roll.
+
+    Parameters:
+        args: (str, str..., str)
+
+    Returns:
+        ParsedRoll
+
+    Raises:
+        InvalidArgumentsError
+    """
+
+    parsed = _fast_parse_sr3(args)
+    if parsed:
+        return parsed
+
+    parsed = SR3_PARSER.parse_args(args)
+    note = tuple(parsed.note) if parsed.note is not None else None
+    return ParsedRoll(parsed.help, parsed.dice, note, parsed.threshold,
+                      parsed.m, parsed.i, parsed.open, parsed.repeat)
+
+
+def _fast_parse_sr3(args):
+    """
+    Reads a roll made of plain numbers, an xN repeat and the -i, -m and -o
+    flags. Returns None for anything else so argparse can deal with it.
+    """
+
+    positional = []
+    repeat = None
+    modifier = 0
+    initiative = 0
+    open_test = False
+
+    args = iter(args)
+    for arg in args:
+        if arg.isdecimal():
+            positional.append(int(arg))
+        elif arg in ("-o", "--open"):
+            open_test = True
+        elif arg in ("-i", "-m"):
+            value = next(args, "")
+            if not value.isdecimal():
+                return None
+            if arg == "-i":
+                initiative = int(value)
+            else:
+                modifier = int(value)
+        elif repeat is None and REPEAT.fullmatch(arg):
+            repeat = int(arg[1:])
+            if repeat < 1:
+                return None
+        else:
+            return None
+
+    if len(positional) > 2:
+        return None
+
+    dice, threshold = (positional + [0, 4][len(positional):])[:2]
+    return ParsedRoll(False, dice, None, threshold, modifier, initiative,
+                      open_test, repeat or 1)
+
+
+class Sr3SimParser(argparse.ArgumentParser):
+    """
+    A parser for SR3E roll simulations
+    """
+
+    def __init__(self):
+        super().__init__(exit_on_error=False, add_help=False)
+        self.prog = "Sr3Simulator"
+        self.add_argument('dice', type=int,
+                          help="The amount of dice to roll.")
+        self.add_argument("threshold", default=4, nargs="?", type=int,
+                          help="The threshold the roll must meet or exceed")
+        self.add_argument("-n", "--trials", default=100000, type=int,
+                          help="The amount of rolls to simulate")
+
+    def error(self, message):
+        raise InvalidArgumentsError
+
+
+SR3_SIM_PARSER = Sr3SimParser()
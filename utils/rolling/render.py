@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from itertools import groupby
+
+from utils.rolling.parsers import SR3_HELP
+from utils.rolling.result import RollResult
+
+
+"""
+Renders roll messages so they always fit in a Discord embed.
+
+Every message is a template with a single slot for the dice. The rest of
+the template is filled in first, and whatever room is left is the budget the
+dice are rendered into. Dice are shown as a plain list when it fits, and as
+runs of equal totals, like "1×3, 2×5, 7+×7", when it doesn't. The length of
+the plain list is worked out from the dice before any of it is built.
+"""
+
+
+# The longest description Discord accepts in an embed
+EMBED_LIMIT = 4096
+
+ELLIPSIS = "…"
+
+
+class Template():
+    """
+    A message with named fields and a single slot for the part that can grow,
+    split around the slot once when it is created.
+    """
+
+    __slots__ = ("head", "tail")
+
+    def __init__(self, text, slot="rolls"):
+        self.head, _, self.tail = text.partition("{" + slot + "}")
+
+    def render(self, rolls=(), limit=EMBED_LIMIT, **fields):
+        """
+        Fills the template, rendering the rolls into whatever room the rest
+        of the message leaves.
+
+        Parameters:
+            rolls: RollResult or [int, int..., int]
+            limit: int
+            fields: values for the other fields in the template
+
+        Returns:
+            message: str
+        """
+
+        head, tail, budget = self.fill(limit, fields)
+        return head + rolls_text(rolls, budget) + tail
+
+    def render_lines(self, lines, limit=EMBED_LIMIT, **fields):
+        """
+        Fills the template, keeping as many of the lines as fit.
+        """
+
+        head, tail, budget = self.fill(limit, fields)
+        return head + bounded_lines(lines, budget) + tail
+
+    def fill(self, limit, fields):
+        head = self.head.format(**fields)
+        tail = self.tail.format(**fields)
+        return head, tail, limit - len(head) - len(tail)
+
+
+def rolls_text(rolls, budget):
+    """
+    Renders dice in at most budget characters.
+
+    Parameters:
+        rolls: RollResult or [int, int..., int]
+        budget: int
+
+    Returns:
+        str
+    """
+
+    # Even a crowded message has room for "[]"
+    budget = max(budget, 2)
+
+    if isinstance(rolls, RollResult):
+        runs = [(total, count) for total, count in enumerate(rolls.counts)
+                if count]
+        ordered = True
+    else:
+        runs = [(total, len(list(run))) for total, run in groupby(rolls)]
+        ordered = all(a[0] < b[0] for a, b in zip(runs, runs[1:]))
+
+    # "[a, b, c]" is two characters per die more than its digits
+    length = sum(count * (len(str(total)) + 2) for total, count in runs)
+
+    if max(length, 2) <= budget:
+        return "[" + ", ".join(str(total) for total, count in runs
+                               for _ in range(count)) + "]"
+
+    if not ordered:
+        return _truncated(runs, budget)
+
+    return _run_lengths(runs, budget)
+
+
+def _run_lengths(runs, budget):
+    """
+    Renders sorted dice as runs of equal totals. If even that is too long,
+    the remaining dice are folded into a single "total+×count" run.
+    """
+
+    if not runs:
+        return "[]"
+
+    remaining = sum(count for _, count in runs)
+    reserve = len(str(runs[-1][0])) + len(str(remaining)) + 4
+
+    parts = []
+    length = 0
+
+    for index, (total, count) in enumerate(runs):
+        part = f"{total}×{count}" if count > 1 else str(total)
+        last = index == len(runs) - 1
+
+        if length + len(part) + (0 if last else reserve) > budget:
+            part = f"{total}+×{remaining}"
+            if length + len(part) > budget:
+                return _fit(", ".join(parts), budget)
+            parts.append(part)
+            break
+
+        parts.append(part)
+        length += len(part) + 2
+        remaining -= count
+
+    return ", ".join(parts)
+
+
+def _truncated(runs, budget):
+    """
+    Renders unsorted dice as a list, cut short once the budget runs out.
+    """
+
+    parts = []
+    length = 2 + len(ELLIPSIS) + 2
+
+    for total, count in runs:
+        for _ in range(count):
+            part = str(total)
+            if length + len(part) + 2 > budget:
+                parts.append(ELLIPSIS)
+                return _fit("[" + ", ".join(parts) + "]", budget)
+            parts.append(part)
+            length += len(part) + 2
+
+    return "[" + ", ".join(parts) + "]"
+
+
+def bounded_lines(lines, budget):
+    """
+    Joins lines with newlines, leaving out the lines that don't fit in the
+    budget.
+    """
+
+    kept = []
+    length = 0
+
+    for line in lines:
+        if length + len(line) + 1 + len(ELLIPSIS) > budget:
+            kept.append(ELLIPSIS)
+            break
+        kept.append(line)
+        length += len(line) + 1
+
+    return "\n".join(kept)
+
+
+def _fit(text, budget):
+    """
+    Last resort for budgets too small to show anything useful.
+    """
+
+    if len(text) <= budget:
+        return text
+    return ELLIPSIS[:max(budget, 0)]
+
+
+ROLL = Template(
+    "\n```md\n"
+    "<{descriptor}: {hits} >\n"
+    "===================\n"
+    "\n"
+    "> Results: {rolls}\n"
+    "> Target Number: {threshold}\n"
+    "\n"
+    "Dice Rolled: {dice}\n"
+    "===================\n"
+    "\n"
+    "{critical_glitch}```"
+)
+
+INITIATIVE = Template(
+    "\n```md\n"
+    "< Initiative {initiative}\n"
+    "==============================\n"
+    "\n"
+    "> Rolls: {rolls}\n"
+    "> Modifier: {modifier}\n"
+    "> Sum: {sum} + {modifier} = {initiative}\n"
+    "\n"
+    "Dice Rolled: {dice}\n"
+    "==============================\n"
+    "```"
+)
+
+OPEN_TEST = Template(
+    "\n```md\n"
+    "< Threshold: {highest} >\n"
+    "===============================\n"
+    "\n"
+    "> Rolls: {rolls}\n"
+    "\n"
+    "Dice Rolled: {dice}\n"
+    "===============================\n"
+    "```"
+)
+
+BATCH = Template(
+    "\n```md\n"
+    "< Total Hits: {total} >\n"
+    "===================\n"
+    "\n"
+    "> Tests: {tests}\n"
+    "> Target Number: {threshold}\n"
+    "> Dice per Test: {dice}\n"
+    "\n"
+    "Test  Hits\n"
+    "{lines}\n"
+    "===================\n"
+    "\n"
+    "> Average Hits: {average:.2f}\n"
+    "> Tests with a Hit: {successes}\n"
+    "> Critical Glitches: {critical_glitches}\n"
+    "```",
+    slot="lines"
+)
+
+EXPRESSION = Template(
+    "\n```md\n"
+    "< {descriptor}: {totals} >\n"
+    "===================\n"
+    "\n"
+    "{lines}\n"
+    "\n"
+    "Expression: {expression}\n"
+    "===================\n"
+    "```",
+    slot="lines"
+)
+
+INITIATIVE_ORDER = Template(
+    "\n```md\n"
+    "< Combat Turn {turn}, Initiative Pass {initiative_pass} >\n"
+    "===================\n"
+    "\n"
+    "{lines}\n"
+    "===================\n"
+    "```",
+    slot="lines"
+)
+
+# The help text never changes, so the whole message is built once. The
+# replaces match how the message has always been laid out.
+HELP = f"\n```md\n{SR3_HELP}\n```".replace("            ", "")
+HELP = HELP.replace("        ", "")
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+from array import array
+from itertools import repeat
+
+
+class RollResult():
+    """
+    A compact record of a roll, stored as a histogram of the die totals
+    instead of a list with one entry per die.
+
+    counts[total] holds how many dice ended on that total. Totals of one
+    through five are single dice, higher totals are exploded sixes. Iterating
+    a result yields every die total in sorted order, the same as the list
+    it replaces.
+    """
+
+    __slots__ = ("counts", "dice")
+
+    def __init__(self, rolls=()):
+        self.counts = array('Q', [0])
+        self.dice = 0
+        self.extend(rolls)
+
+    def add(self, total, count=1):
+        """
+        Adds count dice that ended on total.
+        """
+
+        if not count:
+            return
+
+        if total >= len(self.counts):
+            self.counts.extend([0] * (total + 1 - len(self.counts)))
+
+        self.counts[total] += count
+        self.dice += count
+
+    def extend(self, rolls):
+        """
+        Adds every die total in rolls.
+        """
+
+        if isinstance(rolls, RollResult):
+            for total, count in enumerate(rolls.counts):
+                self.add(total, count)
+            return
+
+        for total in rolls:
+            self.add(total)
+
+    def split(self, threshold):
+        """
+        Splits the roll at a threshold, the way a reroll needs it.
+
+        Parameters:
+            threshold: int
+
+        Returns:
+            (int, RollResult): how many dice were below the threshold, and
+            the dice that met or exceeded it
+        """
+
+        threshold = max(threshold, 0)
+        kept = RollResult()
+        for total, count in enumerate(self.counts[threshold:], threshold):
+            kept.add(total, count)
+
+        return self.dice - kept.dice, kept
+
+    def to_bytes(self):
+        """
+        Packs the roll for storage as (total, count) pairs of varints, each
+        total stored as the step from the previous one. A pool of ordinary
+        dice takes two bytes per distinct total.
+        """
+
+        packed = bytearray()
+        previous = 0
+        for total, count in enumerate(self.counts):
+            if count:
+                _write_varint(packed, total - previous)
+                _write_varint(packed, count)
+                previous = total
+        return bytes(packed)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Unpacks a roll packed by to_bytes.
+        """
+
+        result = cls()
+        position = 0
+        total = 0
+        while position < len(data):
+            step, position = _read_varint(data, position)
+            count, position = _read_varint(data, position)
+            total += step
+            result.add(total, count)
+        return result
+
+    def count(self, total):
+        """
+        Returns how many dice ended on total.
+        """
+
+        if 0 <= total < len(self.counts):
+            return self.counts[total]
+        return 0
+
+    def at_least(self, threshold):
+        """
+        Returns how many dice met or exceeded the threshold.
+        """
+
+        return sum(self.counts[max(threshold, 0):])
+
+    @property
+    def ones(self):
+        return self.count(1)
+
+    @property
+    def highest(self):
+        """
+        The highest total rolled, or None if no dice were rolled.
+        """
+
+        for total in range(len(self.counts) - 1, -1, -1):
+            if self.counts[total]:
+                return total
+        return None
+
+    def __len__(self):
+        return self.dice
+
+    def __iter__(self):
+        for total, count in enumerate(self.counts):
+            yield from repeat(total, count)
+
+    def __eq__(self, other):
+        if isinstance(other, RollResult):
+            return self.trimmed() == other.trimmed()
+        return list(self) == other
+
+    def trimmed(self):
+        """
+        The counts without any trailing empty totals.
+        """
+
+        end = len(self.counts)
+        while end > 1 and not self.counts[end - 1]:
+            end -= 1
+        return self.counts[:end]
+
+    def __repr__(self):
+        return str(list(self))
+
+
+def _write_varint(packed, value):
+    while value > 0x7f:
+        packed.append((value & 0x7f) | 0x80)
+        value >>= 7
+    packed.append(value)
+
+
+def _read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import hashlib
+import os
+
+
+"""
+Counter based random streams for rolling.
+
+Every block of random bytes is the output of SHAKE-256 keyed with a seed, a
+stream index and a block counter. Any block of any stream can be generated
+again from those three numbers alone, so streams can be handed to worker
+processes, drawn from in bulk and replayed exactly.
+
+Each roll spawns its own stream from the shared seed and records the seed
+and stream index as a token that can be replayed later.
+
+Every process also draws from streams of its own boot: the cluster id in the
+top bits and a random nonce picked when it is seeded. Clusters sharing a
+fixed seed, or a bot restarting with one, never hand out the same stream
+twice, and the boot is part of the token so replays stay unambiguous.
+"""
+
+
+# Bits of the boot holding the nonce, the cluster id sits above them
+NONCE_BITS = 48
+
+
+class InvalidTokenError(Exception):
+    """Raised when a replay token cannot be read"""
+    pass
+
+
+class Stream():
+    """
+    An independent stream of random bytes.
+    """
+
+    def __init__(self, seed, index=0, counter=0, boot=0):
+        self.seed = seed
+        self.index = index
+        self.counter = counter
+        self.boot = boot
+        self.key = seed.to_bytes(8, "little") + index.to_bytes(8, "little")
+
+        # Streams without a boot keep the key tokens from before boots had
+        if boot:
+            self.key += boot.to_bytes(8, "little")
+
+    @property
+    def token(self):
+        """
+        A short string identifying this stream that can be replayed.
+        """
+
+        if self.boot:
+            return f"{self.seed:x}:{self.boot:x}:{self.index:x}"
+        return f"{self.seed:x}:{self.index:x}"
+
+    def randbytes(self, amount):
+        """
+        Draws the next block of the stream.
+
+        Parameters:
+            amount: int
+
+        Returns:
+            bytes
+        """
+
+        block = self.key + self.counter.to_bytes(8, "little")
+        self.counter += 1
+        return hashlib.shake_256(block).digest(amount)
+
+    def jump(self, counter):
+        """
+        Moves the stream to the block counter given.
+        """
+
+        self.counter = counter
+
+
+def seed(value=None, cluster=0):
+    """
+    Sets the seed streams are spawned from and starts a new boot. A random
+    seed is used if no value is passed in.
+
+    Parameters:
+        value: int or None
+        cluster: int, the id of the cluster this process runs
+    """
+
+    global _seed, _boot, _index
+
+    if value is None:
+        value = int.from_bytes(os.urandom(8), "little")
+
+    nonce = int.from_bytes(os.urandom(NONCE_BITS // 8), "little")
+
+    _seed = value % (1 << 64)
+    _boot = ((cluster << NONCE_BITS) | nonce) % (1 << 64) or 1
+    _index = 0
+
+
+def spawn():
+    """
+    Creates a new stream that no other roll will draw from.
+
+    Returns:
+        Stream
+    """
+
+    global _index
+
+    stream = Stream(_seed, _index, boot=_boot)
+    _index += 1
+    return stream
+
+
+def from_token(token):
+    """
+    Recreates the stream identified by a replay token.
+
+    Parameters:
+        token: str
+
+    Returns:
+        Stream
+    """
+
+    try:
+        parts = [int(part, 16) for part in token.split(":")]
+        if len(parts) == 2:
+            seed, index = parts
+            return Stream(seed, index)
+
+        seed, boot, index = parts
+        return Stream(seed, index, boot=boot)
+    except (ValueError, OverflowError):
+        raise InvalidTokenError
+
+
+# Reloading the module keeps the seed, so rolls made after a reload can still
+# be replayed and a fixed seed isn't lost
+if "_boot" not in globals():
+    seed(globals().get("_seed"))
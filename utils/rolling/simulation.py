@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/SRBot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import asyncio
+import os
+from functools import lru_cache
+
+from utils.rolling import base, odds, rng
+from utils.rolling.sr3e import critically_glitched, glitched
+
+
+"""
+Monte Carlo simulation of SR3E tests.
+
+Trials are split into one chunk per core and each chunk is run in a worker
+process. The chunks come back as sparse histograms, which are merged and
+summarised in a worker process too, so the event loop only waits on the
+summary.
+"""
+
+
+MAX_TRIALS = 5_000_000
+
+# The total amount of dice a single simulation may roll.
+MAX_DICE_ROLLED = 250_000_000
+
+# Roughly how many dice each worker rolls in one batch.
+BATCH_DICE = 1 << 16
+
+PERCENTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# How many rows of hits are shown at most
+ROWS = 21
+
+
+class SimulationTooLargeError(Exception):
+    """Raised when a simulation would roll too many dice"""
+    pass
+
+
+def run_trials(dice, threshold, trials, token):
+    """
+    Runs a chunk of trials. This is the worker kernel and must stay a plain
+    module level function so it can be sent to a process pool.
+
+    Parameters:
+        dice: int
+        threshold: int
+        trials: int
+        token: str, the token of the rng stream this chunk draws from
+
+    Returns:
+        [histogram, glitches, critical_glitches] where histogram is a dict
+        of {hits: amount of trials}, leaving out the hits no trial scored
+    """
+
+    if not dice:
+        # Every trial of an empty pool scores the same
+        return [{0: trials}, trials, trials]
+
+    stream = rng.from_token(token)
+
+    histogram = [0] * (dice + 1)
+    glitches = 0
+    critical_glitches = 0
+
+    hit_table = _hit_table(threshold)
+    per_batch = max(1, BATCH_DICE // dice)
+
+    while trials:
+        batch = min(per_batch, trials)
+        trials -= batch
+
+        faces = base._faces(batch * dice, stream=stream)
+        scored = faces.translate(hit_table)
+
+        for start in range(0, batch * dice, dice):
+            end = start + dice
+
+            if threshold > 6:
+                sixes = faces.count(6, start, end)
+                hits = _exploded_hits(sixes, threshold - 6, stream)
+            else:
+                hits = scored.count(1, start, end)
+
+            ones = faces.count(1, start, end)
+            histogram[hits] += 1
+            glitches += glitched(ones, dice)
+            critical_glitches += critically_glitched(ones, dice)
+
+    histogram = {hits: count for hits, count in enumerate(histogram) if count}
+    return [histogram, glitches, critical_glitches]
+
+
+def _exploded_hits(dice, threshold, stream):
+    """
+    Rerolls the sixes of a die pool against what remains of the threshold.
+    """
+
+    if threshold <= 1:
+        return dice
+
+    while dice:
+        faces = base._faces(dice, stream=stream)
+        if threshold <= 6:
+            return faces.translate(_hit_table(threshold)).count(1)
+
+        dice = faces.count(6)
+        threshold -= 6
+
+    return 0
+
+
+@lru_cache(maxsize=None)
+def _hit_table(threshold):
+    """
+    Translation table marking a face that meets the threshold with a 1.
+
+    Above a threshold of 6 only the sixes can go on to score.
+    """
+
+    threshold = min(threshold, 6)
+    return bytes(1 if face >= threshold and face else 0
+                 for face in range(256))
+
+
+async def simulate(executor, dice, threshold, trials):
+    """
+    Runs the trials split across the executor with one chunk per core, then
+    merges and summarises the results there as well.
+
+    Parameters:
+        executor: concurrent.futures.Executor
+        dice: int
+        threshold: int
+        trials: int
+
+    Returns:
+        [histogram, glitches, critical_glitches, mean, percentiles]
+
+    Raises:
+        SimulationTooLargeError
+    """
+
+    if (dice > odds.MAX_DICE or trials > MAX_TRIALS
+            or trials * max(dice, 1) > MAX_DICE_ROLLED):
+        raise SimulationTooLargeError
+
+    loop = asyncio.get_running_loop()
+    workers = os.cpu_count() or 1
+    chunk, remainder = divmod(trials, workers)
+
+    jobs = []
+    for worker in range(workers):
+        size = chunk + (worker < remainder)
+        if not size:
+            continue
+        # Each chunk gets an independent stream
+        stream = rng.spawn()
+        jobs.append(loop.run_in_executor(executor, run_trials, dice,
+                                         threshold, size, stream.token))
+
+    results = await asyncio.gather(*jobs)
+    return await loop.run_in_executor(executor, summarize, results, trials)
+
+
+def summarize(results, trials):
+    """
+    Merges the results of the chunks and works out the mean and percentiles
+    of the hits. Runs in a worker process like run_trials.
+
+    Parameters:
+        results: [[histogram, glitches, critical_glitches]...]
+        trials: int
+
+    Returns:
+        [histogram, glitches, critical_glitches, mean, percentiles] where
+        percentiles is a list of (fraction, hits)
+    """
+
+    histogram = {}
+    glitches = 0
+    critical_glitches = 0
+
+    for chunk_histogram, chunk_glitches, chunk_critical_glitches in results:
+        for hits, count in chunk_histogram.items():
+            histogram[hits] = histogram.get(hits, 0) + count
+        glitches += chunk_glitches
+        critical_glitches += chunk_critical_glitches
+
+    histogram = dict(sorted(histogram.items()))
+    mean = sum(hits * count for hits, count in histogram.items()) / trials
+    percentiles = [(fraction, percentile(histogram, trials, fraction))
+                   for fraction in PERCENTILES]
+
+    return [histogram, glitches, critical_glitches, mean, percentiles]
+
+
+def percentile(histogram, trials, fraction):
+    """
+    Gets the amount of hits at the given fraction of the trials.
+
+    Parameters:
+        histogram: dict of {hits: amount of trials}, sorted by hits
+        trials: int
+        fraction: float
+    """
+
+    target = fraction * trials
+    seen = 0
+    for hits, count in histogram.items():
+        seen += count
+        if seen >= target:
+            return hits
+
+    return max(histogram)
+
+
+async def format_simulation(dice, threshold, trials, result):
+    """
+    Formats the result of a simulation in an easy to read fashion.
+
+    Parameters:
+        dice: int
+        threshold: int
+        trials: int
+        result: [histogram, glitches, critical_glitches, mean, percentiles]
+
+    Returns:
+        message: str
+    """
+
+    histogram, glitches, critical_glitches, mean, percentiles = result
+    percentiles = ", ".join(f"p{int(fraction * 100)} {hits}"
+                            for fraction, hits in percentiles)
+
+    # Show the rows around the mean, large pools never score the low ones
+    start = max(min(histogram), round(mean) - ROWS // 2)
+    end = min(max(histogram), start + ROWS - 1)
+
+    largest = max(histogram.values())
+    lines = []
+    for hits in range(start, end + 1):
+        count = histogram.get(hits, 0)
+        bar = "#" * round(20 * count / largest)
+        lines.append(f"{hits:>4}  {count / trials:>6.1%}  {bar}")
+
+    lines = "\n".join(lines)
+
+    message = f"""
+        ```md
+        < Simulation: {dice} dice, Target Number {threshold} >
+        ===================
+
+        > Trials: {trials}
+        > Mean hits: {mean:.2f}
+        > Percentiles: {percentiles}
+        > Glitch rate: {glitches / trials:.2%}
+        > Critical Glitch rate: {critical_glitches / trials:.2%}
+
+        Hits  Trials
+        {{lines}}
+        ===================
+        ```"""
+
+    message = message.replace("        ", "")
+    message = message.replace("{lines}", lines)
+
+    return message
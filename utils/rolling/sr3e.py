@@ -7,28 +7,54 @@ Please see the license for any restrictions or rights granted to you by the
 License.
 """
 
-from utils.rolling import base
-from utils.rolling.parsers import Sr3RollParser
+from utils.rolling import base, render, rng
+from utils.rolling.result import RollResult
+from utils.rolling.parsers import parse_sr3
 
 
 """
 The rolling rules can be found on page 38 of the SR3E core rulebook.
+
+The module level functions are the rules engine. They do no I/O and never
+touch the event loop, so they can be called from scripts, threads or
+process pools. Given a stream they always produce the same result. Roll is
+the async facade the cogs use.
 """
 
 
+# The most tests a single batch roll may repeat.
+MAX_REPEAT = 50
+
+# The most dice a single roll may use over all its tests.
+MAX_DICE = 100_000
+
+
+class RollTooLargeError(Exception):
+    """Raised when a roll repeats too often or uses too many dice"""
+    pass
+
+
 class Roll():
     """
     An easy way to represent a roll.
     """
-    def __init__(self, *to_parse):
-        self.parser = Sr3RollParser()
-        parsed = self.parser.parse_args(to_parse)
+    def __init__(self, *to_parse, stream=None):
+        parsed = parse_sr3(to_parse)
+
+        # Rolled in one go on the event loop, so the size has to be bounded
+        if parsed.repeat > MAX_REPEAT:
+            raise RollTooLargeError(f"A roll may repeat at most {MAX_REPEAT} "
+                                    "tests.")
+        if parsed.dice * parsed.repeat > MAX_DICE:
+            raise RollTooLargeError(f"A roll may use at most {MAX_DICE} dice "
+                                    "over all its tests.")
 
         # Used to determine which kind of roll this is later
         self.roll_type = None
 
         self.threshold = parsed.threshold
         self.dice = parsed.dice
+        self.repeat = parsed.repeat
 
         if parsed.help:
             self.footer = "SR3e Roll Help"
@@ -39,12 +65,22 @@ class Roll():
         elif parsed.open:
             self.footer = "SR3e Open Test"
             self.roll_type = "open"
+        elif self.repeat > 1:
+            self.footer = "SR3e Batch Roll"
+            self.roll_type = "batch"
         else:
             self.footer = "SR3e Roll"
             self.roll_type = "general"
 
+        # Every roll draws from its own stream so it can be replayed later
+        self.stream = stream or rng.spawn()
+        self.token = self.stream.token
+        if self.roll_type != "help":
+            self.footer += f" | {self.token}"
+
         self.title = None
         self.rolls = None
+        self.results = None
         self.hits = None
         self.glitch = False
         self.critical_glitch = False
@@ -58,38 +94,55 @@ class Roll():
         Rolls the dice and sets all the appropriate attributes
         """
 
-        self.rolls = await roll(self.dice)
-        self.hits = await hits(self.rolls, self.threshold)
-        self.critical_glitch = await critical_glitch(self.rolls)
-        self.glitch = await glitch(self.rolls)
+        self.rolls = roll(self.dice, self.stream)
+        self.tally()
 
         # Generate the message so it's ready to go.
         await self.formatted_message()
 
+    async def batch_roll(self):
+        """
+        Rolls the same test self.repeat times in one pass of the dice engine.
+        The last test is kept in self.rolls so it can be rerolled.
+        """
+
+        self.results = roll_many(self.dice, self.repeat, self.stream)
+        self.rolls = self.results[-1]
+        self.tally()
+
+        await self.format_batch_message()
+
     async def reroll(self, saved):
         """
         Runs a reroll with the dice passed in.
         """
 
-        self.rolls = await roll(self.dice)
+        self.rolls = roll(self.dice, self.stream)
         self.rolls.extend(saved)
-        self.rolls.sort()
 
         self.dice += len(saved)
 
-        self.hits = await hits(self.rolls, self.threshold)
-        self.critical_glitch = await critical_glitch(self.rolls)
-        self.glitch = await glitch(self.rolls)
-
+        self.tally()
         await self.formatted_message()
 
+    def tally(self):
+        """
+        Works out the hits and glitches from the histogram of the rolls.
+        """
+
+        ones = self.rolls.ones
+        self.hits = self.rolls.at_least(self.threshold)
+        self.critical_glitch = critically_glitched(ones, len(self.rolls))
+        self.glitch = glitched(ones, len(self.rolls))
+
     async def initiative_roll(self):
         """
         Rolls initiative.
         """
 
-        self.rolls, self.initiative = await roll_initiative(self.dice,
-                                                            self.init_mod)
+        self.rolls, self.initiative = roll_initiative(self.dice,
+                                                      self.init_mod,
+                                                      self.stream)
         await self.format_initiative_message()
 
     async def open_test(self):
@@ -97,7 +150,7 @@ class Roll():
         Rolls an open test and formats the message accordingly.
         """
 
-        self.rolls = await roll(self.dice)
+        self.rolls = roll(self.dice, self.stream)
 
         await self.format_open_test()
 
@@ -110,135 +163,165 @@ class Roll():
         if self.hits > 1:
             descriptor = "Hits"
 
-        self.message = f"""
-            ```md
-            <{descriptor}: {self.hits} >
-            ===================
+        critical = "< Critical Glitch >\n" if self.critical_glitch else ""
 
-            > Results: {self.rolls}
-            > Target Number: {self.threshold}
+        self.message = render.ROLL.render(self.rolls, descriptor=descriptor,
+                                          hits=self.hits,
+                                          threshold=self.threshold,
+                                          dice=self.dice,
+                                          critical_glitch=critical)
 
-            Dice Rolled: {self.dice}
-            ===================
+    async def format_batch_message(self):
+        """
+        Formats a batch of tests as a table with the totals underneath.
+        """
 
-            """
+        lines = []
+        total = 0
+        successes = 0
+        critical_glitches = 0
 
-        if self.critical_glitch:
-            self.message += "< Critical Glitch >\n"
+        for test, result in enumerate(self.results, start=1):
+            hits = result.at_least(self.threshold)
+            crit = critically_glitched(result.ones, len(result))
+            total += hits
+            successes += hits > 0
+            critical_glitches += crit
 
-        self.message += "```"
+            marker = "  < Critical Glitch >" if crit else ""
+            lines.append(f"{test:>4}  {hits:>4}{marker}")
 
-        self.message = self.message.replace("            ", "")
+        self.message = render.BATCH.render_lines(
+            lines, total=total, tests=len(self.results),
+            threshold=self.threshold, dice=self.dice,
+            average=total / len(self.results), successes=successes,
+            critical_glitches=critical_glitches)
 
     async def format_initiative_message(self):
         """
         Formats the initiative in an easy to read fashion.
         """
 
-        self.message = f"""
-            ```md
-            < Initiative {self.initiative}
-            ==============================
-
-            > Rolls: {self.rolls}
-            > Modifier: {self.init_mod}
-            > Sum: {sum(self.rolls)} + {self.init_mod} = {self.initiative}
-
-            Dice Rolled: {self.dice}
-            ==============================
-            ```"""
-
-        self.message = self.message.replace("            ", "")
+        self.message = render.INITIATIVE.render(self.rolls,
+                                                initiative=self.initiative,
+                                                modifier=self.init_mod,
+                                                sum=sum(self.rolls),
+                                                dice=self.dice)
 
     async def format_help(self):
         """
         Formats a help message that can be returned to the user.
         """
 
-        self.message = f"""
-        ```md
-        {self.parser.format_help()}
-        ```"""
-
-        self.message = self.message.replace("            ", "")
-        self.message = self.message.replace("        ", "")
+        self.message = render.HELP
 
     async def format_open_test(self):
         """
         Formats an open test to return to the user.
         """
 
-        self.message = f"""
-            ```md
-            < Threshold: {self.rolls[-1]} >
-            ===============================
+        self.message = render.OPEN_TEST.render(self.rolls,
+                                               highest=self.rolls.highest,
+                                               dice=self.dice)
 
-            > Rolls: {self.rolls}
 
-            Dice Rolled: {self.dice}
-            ===============================
-            ```"""
+def roll(dice, stream=None):
+    """
+    Rolls the specified amount of dice. This rerolls sixes and adds the
+    results to the original rolls.
 
-        self.message = self.message.replace("            ", "")
+    Every round of exploding sixes is rolled as a single batch, so the cost
+    depends on the amount of rounds rather than the amount of dice.
 
+    Parameters:
+        dice: int
+        stream: rng.Stream or None
 
-async def roll(dice):
+    Returns:
+        rolls: RollResult
     """
-    Rolls the specified amount of dice. This rerolls sixes and adds the
-    results to the original rolls.
+
+    return roll_many(dice, 1, stream)[0]
+
+
+def roll_many(dice, tests, stream=None):
+    """
+    Rolls the same amount of dice for several tests at once. Every round of
+    exploding sixes across all the tests is rolled as a single batch.
 
     Parameters:
         dice: int
+        tests: int
+        stream: rng.Stream or None
 
     Returns:
-        rolls: [int, int..., int]
+        results: [RollResult, RollResult..., RollResult]
     """
 
-    rolls = await base.roll(dice)
-    rolls.sort()
+    if stream is None:
+        stream = rng.spawn()
+
+    results = [RollResult() for _ in range(tests)]
+    active = [dice] * tests
+    offset = 0
+
+    while any(active):
+        faces = base._faces(sum(active), stream=stream)
+        start = 0
+
+        for test, result in enumerate(results):
+            end = start + active[test]
 
-    six = [roll for roll in rolls if roll == 6]
+            # Faces one through five are final. Every die still in play has
+            # rolled a six in each previous round.
+            for face in range(1, 6):
+                result.add(offset + face, faces.count(face, start, end))
 
-    if six:
-        pos = len(rolls) - len(six)
-        rolls[pos:] = [x + y for x, y in zip(six, await roll(len(six)))]
+            active[test] = faces.count(6, start, end)
+            start = end
 
-    return rolls
+        offset += 6
 
+    return results
 
-async def hits(rolls, threshold):
+
+def hits(rolls, threshold):
     """
     Checks the rolls to see how many of the rolls meet or exceed the threshold.
 
     Parameters:
-        rolls: [int, int, int..., int]
+        rolls: [int, int, int..., int] or RollResult
         threshold: int
 
     Returns:
         count: int
     """
 
+    if isinstance(rolls, RollResult):
+        return rolls.at_least(threshold)
+
     count = [roll for roll in rolls if roll >= threshold]
     return len(count)
 
 
-async def roll_initiative(dice, modifier):
+def roll_initiative(dice, modifier, stream=None):
     """
     Rolls initiative and returns the total value of the rolls + modifier
 
     Parameters:
         dice: int
         modifier: int
+        stream: rng.Stream or None
 
     Returns:
         initiative: int
     """
 
-    rolls = [await base.roll() for i in range(0, dice)]
+    rolls = base.roll(dice, stream=stream)
     return [rolls, sum(rolls) + modifier]
 
 
-async def critical_glitch(rolls):
+def critical_glitch(rolls):
     """
     Checks to see if a critical glitch has occurred. This occurs when all the
     dice are 1's.
@@ -250,11 +333,10 @@ async def critical_glitch(rolls):
         True or None
     """
 
-    ones = [roll for roll in rolls if roll == 1]
-    return len(ones) == len(rolls)
+    return critically_glitched(rolls.count(1), len(rolls))
 
 
-async def glitch(rolls):
+def glitch(rolls):
     """
     Checks to see if a glitch has occurred. A glitch occurs when the amount of
     ones is >= the amount of rolled * .5.
@@ -272,13 +354,27 @@ async def glitch(rolls):
     Returns:
         True or None
     """
-    ones = [roll for roll in rolls if roll == 1]
-    rolls = len(rolls)
 
-    if not (rolls % 2) == 0:
-        rolls += 1
+    return glitched(rolls.count(1), len(rolls))
+
+
+def critically_glitched(ones, dice):
+    """
+    The critical glitch rule, given the amount of ones among the dice rolled.
+    """
+
+    return ones == dice
+
+
+def glitched(ones, dice):
+    """
+    The glitch rule, given the amount of ones among the dice rolled.
+    """
+
+    if not (dice % 2) == 0:
+        dice += 1
 
-    if len(ones) >= (rolls / 2):
+    if ones >= (dice / 2):
         return True
 
     return False
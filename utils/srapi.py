@@ -12,6 +12,7 @@ License.
 import aiohttp
 import json
 from discord import Colour, Embed
+from utils import metrics
 
 
 async def get_quote(quote_type=None):
@@ -186,6 +187,7 @@ async def format_character(character_json):
     return content
 
 
+@metrics.timed("http")
 async def fetch(session, url):
     async with session.get(url) as html:
         return await html.text()
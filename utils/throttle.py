@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+This software is licensed under the License (MIT) located at
+https://github.com/ephreal/srbot/Licence
+
+Please see the license for any restrictions or rights granted to you by the
+License.
+"""
+
+import argparse
+import math
+import time
+
+from utils.rolling import expressions, parsers, sr3e
+
+
+"""
+Token bucket throttling for commands.
+
+Every user, channel and guild has a bucket of tokens. Running a command takes
+its cost from all three buckets at once, and is refused if any of them is
+short. A command costing more than a bucket holds could never be afforded,
+and is refused outright. Buckets are refilled lazily from the time they were
+last touched, so an idle bucket costs nothing until it is used again, and
+buckets that have been idle long enough to be full are dropped altogether.
+
+Commands cost one token unless listed in COSTS. Commands listed in SCALED cost
+one more token for every so many dice asked for, counting every repeat of a
+batch or expression, so the largest rolls allowed take most of a user's bucket
+while a roll of 6 barely registers. The dice are read from the parsed roll, so
+a number in a note costs nothing.
+"""
+
+
+# (capacity, tokens refilled per second) for each scope
+LIMITS = {
+    "user": (10, 0.5),
+    "channel": (30, 2.0),
+    "guild": (60, 4.0),
+}
+
+COSTS = {
+    "help": 0,
+    "odds": 2,
+    "sim": 5,
+    "quote": 3,
+    "character": 3,
+}
+
+# Extra tokens per this many dice. The largest SR3E roll, sr3e.MAX_DICE, and
+# the largest expression both stay within a user's bucket.
+SCALED = {
+    "roll": 25_000,
+    "replay": 25_000,
+}
+
+# How often idle buckets are swept away, in seconds
+SWEEP_INTERVAL = 300
+
+
+class Throttle():
+    """
+    The buckets for every scope, kept as {scope: {id: [tokens, last]}}.
+    """
+
+    __slots__ = ("limits", "costs", "scaled", "buckets", "warned",
+                 "clock", "last_sweep")
+
+    def __init__(self, limits=None, costs=None, scaled=None,
+                 clock=time.monotonic):
+        self.limits = dict(LIMITS, **(limits or {}))
+        self.costs = dict(COSTS, **(costs or {}))
+        self.scaled = dict(SCALED, **(scaled or {}))
+        self.buckets = {scope: {} for scope in self.limits}
+        self.warned = {}
+        self.clock = clock
+        self.last_sweep = clock()
+
+    def cost(self, name, args=()):
+        """
+        Works out how many tokens a command costs.
+
+        Parameters:
+            name: str, the qualified name of the command
+            args: (str, str..., str), the arguments it was invoked with
+
+        Returns:
+            int
+        """
+
+        cost = self.costs.get(name, 1)
+
+        per_token = self.scaled.get(name)
+        if per_token:
+            cost += dice_asked(name, args) // per_token
+
+        return cost
+
+    def take(self, keys, cost):
+        """
+        Takes cost tokens from the bucket of each scope, but only if all of
+        them can afford it.
+
+        Parameters:
+            keys: {scope: id}, scopes with an id of None are skipped
+            cost: int
+
+        Returns:
+            float, 0 if the tokens were taken, otherwise how many seconds to
+            wait until they could be, or math.inf if they never could be
+        """
+
+        now = self.clock()
+        if now - self.last_sweep > SWEEP_INTERVAL:
+            self.sweep(now)
+
+        buckets = []
+        wait = 0.0
+
+        for scope, key in keys.items():
+            if key is None or scope not in self.buckets:
+                continue
+
+            capacity, rate = self.limits[scope]
+            bucket = self.buckets[scope].get(key)
+            if bucket is None:
+                bucket = self.buckets[scope][key] = [capacity, now]
+            else:
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if cost > capacity:
+                return math.inf
+
+            if bucket[0] < cost:
+                wait = max(wait, (cost - bucket[0]) / rate)
+            buckets.append(bucket)
+
+        if wait:
+            return wait
+
+        for bucket in buckets:
+            bucket[0] -= cost
+
+        return 0.0
+
+    def should_warn(self, key, wait):
+        """
+        Checks whether a throttled user should be told about it. Users are
+        told once per throttled stretch, so spamming a throttled command
+        doesn't turn into spamming the channel with warnings.
+        """
+
+        now = self.clock()
+        if self.warned.get(key, 0) > now:
+            return False
+
+        self.warned[key] = now + wait
+        return True
+
+    def sweep(self, now=None):
+        """
+        Drops the buckets that have been idle long enough to be full again.
+        """
+
+        if now is None:
+            now = self.clock()
+
+        for scope, buckets in self.buckets.items():
+            capacity, rate = self.limits[scope]
+            full = capacity / rate
+            idle = [key for key, (_, last) in buckets.items()
+                    if now - last >= full]
+            for key in idle:
+                del buckets[key]
+
+        self.warned = {key: until for key, until in self.warned.items()
+                       if until > now}
+        self.last_sweep = now
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self.buckets.values())
+
+
+def dice_asked(name, args):
+    """
+    Counts the dice a roll asks for over all its repeats. Arguments that
+    don't parse ask for none, the command will refuse them anyway.
+
+    Parameters:
+        name: str, the qualified name of the command
+        args: (str, str..., str)
+
+    Returns:
+        int
+    """
+
+    args = tuple(args)
+    if name == "replay":
+        # Skip the replay token
+        args = args[1:]
+
+    if expressions.looks_like_expression(args):
+        expression, _ = expressions.split_note(args)
+        try:
+            return expressions.compile_expression(expression).dice
+        except expressions.ExpressionError:
+            return 0
+
+    # Looked up through the modules, so reloading them doesn't leave this
+    # catching the classes they had before
+    try:
+        parsed = parsers.parse_sr3(args)
+    except (parsers.InvalidArgumentsError, argparse.ArgumentError):
+        return 0
+
+    return max(parsed.dice, 0) * min(parsed.repeat, sr3e.MAX_REPEAT)
+
+
+def from_config(config):
+    """
+    Builds a Throttle from the "throttle" section of the config.
+
+    Parameters:
+        config: dict
+
+    Returns:
+        Throttle
+    """
+
+    config = config.get("throttle", {})
+    limits = {scope: tuple(limit)
+              for scope, limit in config.get("limits", {}).items()}
+
+    return Throttle(limits, config.get("costs"), config.get("scaled"))
+
+
+async def admit(bot, ctx):
+    """
+    Takes the tokens for a command about to be invoked, telling the user if
+    they have to wait.
+
+    Parameters:
+        bot: commands.Bot
+        ctx: commands.Context
+
+    Returns:
+        bool, True if the command may run
+    """
+
+    if ctx.command is None:
+        return True
+
+    message = ctx.message
+    keys = {
+        "user": message.author.id,
+        "channel": message.channel.id,
+        "guild": message.guild.id if message.guild else None,
+    }
+
+    # get_context leaves the view just past the command name
+    args = ctx.view.buffer[ctx.view.index:].split()
+    cost = bot.throttle.cost(ctx.command.qualified_name, args)
+    wait = bot.throttle.take(keys, cost)
+    if not wait:
+        return True
+
+    bot.dispatch_stats.throttled += 1
+    if wait == math.inf:
+        await ctx.send(f"{message.author.display_name}, that's more than can "
+                       "be run at once. Try something smaller.")
+        return False
+
+    if bot.throttle.should_warn(message.author.id, wait):
+        await ctx.send(f"{message.author.display_name}, you're sending "
+                       f"commands too quickly. Try again in {wait:.1f} "
+                       "seconds.")
+    return False